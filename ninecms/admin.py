@@ -12,9 +12,10 @@ from django.conf.urls import url
 from django.core.exceptions import PermissionDenied
 from django.utils.translation import ugettext as _
 from mptt.admin import MPTTModelAdmin
-# noinspection PyPackageRequirements
-from guardian.shortcuts import get_objects_for_user
 from ninecms import models, forms, views
+from ninecms.signals import invalidate_nodes
+from ninecms.utils.perms import get_page_type_perms
+from ninecms.utils.aliases import regenerate_aliases
 
 
 # noinspection PyMethodMayBeStatic
@@ -120,6 +121,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(status=True)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as published.") % r)
     node_publish.short_description = _("Mark selected nodes status as published")
 
@@ -130,6 +132,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(status=False)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as not published.") % r)
     node_unpublish.short_description = _("Mark selected nodes status as not published")
 
@@ -140,6 +143,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(promote=True)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as promoted.") % r)
     node_promote.short_description = _("Mark selected nodes as promoted")
 
@@ -150,6 +154,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(promote=False)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as not promoted.") % r)
     node_demote.short_description = _("Mark selected nodes as not promoted")
 
@@ -160,6 +165,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(sticky=True)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as sticky.") % r)
     node_sticky.short_description = _("Mark selected nodes as sticky")
 
@@ -170,19 +176,19 @@ class NodeAdmin(admin.ModelAdmin):
         :return: None
         """
         r = queryset.update(sticky=False)
+        invalidate_nodes(queryset.values_list('pk', flat=True))
         messages.success(request, _("%d nodes successfully updated as not sticky.") % r)
     node_unsticky.short_description = _("Mark selected nodes as not sticky")
 
     def node_reset_alias(self, request, queryset):
         """ Reset url alias for all selected nodes
+        Aliases are regenerated in bulk, see `ninecms.utils.aliases`
         :param request: the request object
         :param queryset: the Node queryset
         :return: None
         """
-        for node in queryset:
-            node.alias = ''
-            node.save()
-        messages.success(request, _("%d nodes successfully updated.") % len(queryset))
+        processed = regenerate_aliases(queryset)[0]
+        messages.success(request, _("%d nodes successfully updated.") % processed)
     node_reset_alias.short_description = _("Reset url alias for all selected nodes")
 
     def check_perm(self, request, obj, perm):
@@ -194,8 +200,7 @@ class NodeAdmin(admin.ModelAdmin):
         """
         if not obj:
             return request.user.has_perm('ninecms.%s_node' % perm)
-        types = get_objects_for_user(request.user, 'ninecms.%s_node_pagetype' % perm, klass=models.PageType)
-        return obj.page_type in types
+        return obj.page_type_id in get_page_type_perms(request)[perm]
 
     def has_change_permission(self, request, obj=None):
         """ Check user permission on Node change
@@ -230,8 +235,7 @@ class NodeAdmin(admin.ModelAdmin):
         :return: Node queryset
         """
         qs = super(NodeAdmin, self).get_queryset(request)
-        types = get_objects_for_user(request.user, 'ninecms.change_node_pagetype', klass=models.PageType)
-        return qs.filter(page_type__id__in=types.values_list('id'))
+        return qs.filter(page_type__id__in=get_page_type_perms(request)['change'])
 
     def get_form(self, request, obj=None, **kwargs):
         """ Override form to pass the current user
@@ -283,10 +287,10 @@ class NodeAdmin(admin.ModelAdmin):
         :return: parent method return
         """
         if db_field.name == 'page_type':
-            page_types = get_objects_for_user(request.user, 'ninecms.add_node_pagetype', klass=models.PageType)
-            if len(page_types) < 1 and not request.user.is_superuser:
+            page_type_ids = get_page_type_perms(request)['add']
+            if not page_type_ids and not request.user.is_superuser:
                 raise PermissionDenied
-            kwargs['queryset'] = page_types
+            kwargs['queryset'] = models.PageType.objects.filter(id__in=page_type_ids)
         elif db_field.name == 'user' and not request.user.is_superuser:
             kwargs['queryset'] = User.objects.filter(pk=request.user.pk)
         return super(NodeAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
@@ -5,6 +5,7 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django.apps import AppConfig
+from django.conf import settings
 
 
 # noinspection PyUnresolvedReferences
@@ -15,3 +16,7 @@ class NineCMSConfig(AppConfig):
     def ready(self):
         import ninecms.signals
         import ninecms.checks
+        if settings.PAGE_TEMPLATES_WARM:
+            from django.core.signals import request_started
+            from ninecms.utils.templates import warm_on_first_request
+            request_started.connect(warm_on_first_request, dispatch_uid='ninecms_warm_page_templates')
@@ -0,0 +1,100 @@
+""" Management command for generating image styles """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connections
+from ninecms.models import Image
+from ninecms.utils.media import generate_style, is_stale, load_manifest, save_manifest, update_manifest
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+
+
+class Command(BaseCommand):
+    help = "Generate the missing or stale image style derivatives of all images. " \
+           "Derivatives of styles not recorded in the manifest yet (eg on the first run) are also checked for size."
+
+    def add_arguments(self, parser):
+        """ Add command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--style', action='append', dest='styles', default=[],
+                            help="Generate only this image style; can be used multiple times.")
+        parser.add_argument('--concurrency', '-j', type=int, dest='concurrency', default=os.cpu_count() or 1,
+                            help="Number of worker processes, default is the number of CPUs.")
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only report the derivatives that would be generated.")
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help="Generate all derivatives, even if not stale.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        The style definitions are recorded in the manifest before generating,
+        so that an interrupted run can be resumed by running the command again
+        :param args: None
+        :param options: styles, concurrency, dry_run, force
+        :return: None
+        """
+        styles = options['styles'] or sorted(settings.IMAGE_STYLES)
+        unknown = set(styles) - set(settings.IMAGE_STYLES)
+        if unknown:
+            raise CommandError("Unknown image styles: %s" % ', '.join(sorted(unknown)))
+        manifest = load_manifest()
+        # styles not recorded yet may have existing derivatives of another definition, so check their size
+        unrecorded = set(style for style in styles if style not in manifest)
+        for style in update_manifest(manifest, styles):
+            self.stdout.write("Style %s has changed, all of its derivatives are stale." % style)
+        if not options['dry_run']:
+            save_manifest(manifest)
+
+        # find the derivatives to generate
+        storage = Image._meta.get_field('image').storage
+        tasks = []
+        for name in Image.objects.exclude(image='').values_list('image', flat=True).distinct().iterator():
+            path_file_name = storage.path(name)
+            for style in styles:
+                if options['force'] or is_stale(path_file_name, style, manifest[style]['since'],
+                                                style in unrecorded):
+                    tasks.append((path_file_name, style))
+        for style in styles:
+            self.stdout.write("%s: %d derivatives to generate." % (style, sum(1 for task in tasks if task[1] == style)))
+        if options['dry_run']:
+            self.stdout.write("Dry run: %d derivatives would be generated." % len(tasks))
+            return
+
+        # generate in worker processes
+        failed = 0
+        for done, (task, result) in enumerate(self.generate(tasks, options['concurrency']), 1):
+            if result is None:
+                failed += 1
+                self.stderr.write("Failed to generate %s for %s." % (task[1], task[0]))
+            elif options['verbosity'] > 1:
+                self.stdout.write(result)
+            if done % max(1, len(tasks) // 20) == 0 or done == len(tasks):
+                self.stdout.write("Generated %d/%d derivatives (%d%%)." % (done, len(tasks), done * 100 / len(tasks)))
+        self.stdout.write("%d derivatives generated, %d failed." % (len(tasks) - failed, failed))
+
+    def generate(self, tasks, concurrency):
+        """ Generate derivatives, in a process pool if concurrency is more than 1
+        :param tasks: a list of (path file name, style) tuples
+        :param concurrency: the number of worker processes
+        :return: a generator of (task, result) as completed; result is the style path file name or None if failed
+        """
+        if concurrency <= 1:
+            for task in tasks:
+                yield task, generate_style(*task)
+            return
+        # do not share database connections with the worker processes
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=concurrency) as executor:
+            futures = dict((executor.submit(generate_style, *task), task) for task in tasks)
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception:  # pragma: nocover
+                    result = None
+                yield futures[future], result
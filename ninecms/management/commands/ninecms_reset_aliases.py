@@ -0,0 +1,52 @@
+""" Management command for regenerating node url aliases """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand, CommandError
+from ninecms.models import Node, PageType
+from ninecms.utils.aliases import regenerate_aliases
+
+
+class Command(BaseCommand):
+    help = "Regenerate the url aliases of nodes from the url pattern of their page type."
+
+    def add_arguments(self, parser):
+        """ Add command arguments
+        :param parser: the argument parser
+        :return: None
+        """
+        parser.add_argument('--page-type', action='append', dest='page_types', default=[],
+                            help="Regenerate only nodes of this page type name; can be used multiple times.")
+        parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=None,
+                            help="Number of nodes per update statement, default is ALIAS_REGENERATE_CHUNK_SIZE.")
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only report the number of aliases that would change.")
+
+    def handle(self, *args, **options):
+        """ Core function
+        :param args: None
+        :param options: page_types, chunk_size, dry_run
+        :return: None
+        """
+        nodes = Node.objects.all()
+        if options['page_types']:
+            names = set(PageType.objects.filter(name__in=options['page_types']).values_list('name', flat=True))
+            unknown = set(options['page_types']) - names
+            if unknown:
+                raise CommandError("Unknown page types: %s" % ', '.join(sorted(unknown)))
+            nodes = nodes.filter(page_type__name__in=options['page_types'])
+        processed, changed = regenerate_aliases(nodes, options['chunk_size'], options['dry_run'], self.progress)
+        if options['dry_run']:
+            self.stdout.write("%d nodes processed, %d aliases would change." % (processed, changed))
+        else:
+            self.stdout.write("%d nodes processed, %d aliases changed." % (processed, changed))
+
+    def progress(self, done, total):
+        """ Report the progress of writes
+        :param done: the number of nodes written
+        :param total: the total number of nodes to write
+        :return: None
+        """
+        self.stdout.write("%d/%d aliases written." % (done, total))
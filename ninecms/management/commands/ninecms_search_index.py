@@ -0,0 +1,32 @@
+""" Management command for rebuilding the search index """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.management import BaseCommand
+from ninecms.models import Node
+from ninecms.utils.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index of all nodes for the search backend in use."
+
+    def handle(self, *args, **options):
+        """ Core function
+        :param args: None
+        :param options: None
+        :return: None
+        """
+        total = Node.objects.count()
+        count = get_backend().rebuild(Node.objects.order_by('id'), lambda done: self.progress(done, total))
+        self.stdout.write("%d nodes indexed." % count)
+
+    def progress(self, done, total):
+        """ Report the progress every 1000 nodes
+        :param done: the number of nodes indexed
+        :param total: the total number of nodes
+        :return: None
+        """
+        if done % 1000 == 0:
+            self.stdout.write("%d/%d nodes indexed." % (done, total))
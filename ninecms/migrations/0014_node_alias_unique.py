@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Unique index on node alias and language, for non empty aliases
+# Partial indexes are supported by sqlite and postgresql; on other databases the index is not created
+# and Node.save falls back to checking for duplicates after save
+
+from __future__ import unicode_literals
+from django.db import migrations
+from django.db.models import Count
+
+ALIAS_UNIQUE_VENDORS = ('sqlite', 'postgresql')
+
+
+# noinspection PyUnusedLocal
+# noinspection PyPep8Naming
+def resolve_duplicate_aliases(apps, schema_editor):
+    """ Append the node id to duplicate aliases, except for the first node, as Node.save used to
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    Node = apps.get_model('ninecms', 'Node')
+    duplicates = Node.objects.exclude(alias='').values('alias', 'language')\
+        .annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:  # pragma: nocover
+        nodes = Node.objects.filter(alias=duplicate['alias'], language=duplicate['language']).order_by('id')
+        for node in nodes[1:]:
+            Node.objects.filter(id=node.id).update(alias='%s/%d' % (node.alias, node.id))
+
+
+def create_index(apps, schema_editor):
+    """ Create the partial unique index
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    if schema_editor.connection.vendor in ALIAS_UNIQUE_VENDORS:
+        schema_editor.execute("CREATE UNIQUE INDEX ninecms_node_alias_language_uniq "
+                              "ON ninecms_node (alias, language) WHERE alias <> ''")
+
+
+def drop_index(apps, schema_editor):  # pragma: nocover
+    """ Drop the partial unique index
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    if schema_editor.connection.vendor in ALIAS_UNIQUE_VENDORS:
+        schema_editor.execute("DROP INDEX ninecms_node_alias_language_uniq")
+
+
+# noinspection PyUnusedLocal
+def reverse(apps, schema_editor):  # pragma: nocover
+    """ Nothing to do here, resolved aliases remain unique
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    pass
+
+
+class Migration(migrations.Migration):
+    """ Migration class """
+
+    dependencies = [
+        ('ninecms', '0013_auto_20160117_1209'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicate_aliases, reverse),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninecms', '0014_node_alias_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100, verbose_name='token')),
+                ('weight', models.IntegerField(default=1, verbose_name='weight')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='ninecms.Node', verbose_name='node')),
+            ],
+            options={
+                'verbose_name': 'search token',
+                'verbose_name_plural': 'search tokens',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchtoken',
+            unique_together=set([('token', 'node')]),
+        ),
+    ]
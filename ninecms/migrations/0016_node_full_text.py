@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Full text index of nodes for the database search backend (see ninecms.utils.search)
+# SQLite: FTS5 virtual table, if the FTS5 extension is available
+# PostgreSQL: tsvector table with a GIN index
+# On other databases nothing is created and the token index is used instead
+# The index is populated with: ./manage.py ninecms_search_index
+
+from __future__ import unicode_literals
+from django.db import migrations, DatabaseError
+
+
+# noinspection PyUnusedLocal
+def create_index(apps, schema_editor):
+    """ Create the full text index table
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute("CREATE VIRTUAL TABLE ninecms_node_fts USING fts5("
+                                  "title, highlight, summary, body, tokenize = 'unicode61 remove_diacritics 2')")
+        except DatabaseError:  # pragma: nocover
+            pass
+    elif vendor == 'postgresql':  # pragma: nocover
+        schema_editor.execute("CREATE TABLE ninecms_node_search ("
+                              "node_id integer PRIMARY KEY REFERENCES ninecms_node (id) "
+                              "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                              "document tsvector NOT NULL)")
+        schema_editor.execute("CREATE INDEX ninecms_node_search_document ON ninecms_node_search USING GIN (document)")
+
+
+# noinspection PyUnusedLocal
+def drop_index(apps, schema_editor):  # pragma: nocover
+    """ Drop the full text index table
+    :param apps: app registry
+    :param schema_editor
+    :return: None
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS ninecms_node_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS ninecms_node_search")
+
+
+class Migration(migrations.Migration):
+    """ Migration class """
+
+    dependencies = [
+        ('ninecms', '0015_searchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
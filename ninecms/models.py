@@ -4,7 +4,7 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
-from django.db import models
+from django.db import models, connections, router, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.dateformat import DateFormat
@@ -15,6 +15,8 @@ from ninecms.utils.nodes import get_full_path
 from ninecms.utils.media import image_path_file_name, file_path_file_name, validate_file_ext, video_path_file_name, \
     validate_video_ext
 from ninecms.utils.transliterate import transliterate
+from functools import partial
+import itertools
 import re
 
 """
@@ -67,6 +69,10 @@ class PageType(models.Model):
         verbose_name_plural = _("page types")
 
 
+# Database vendors that support the partial unique index on node alias and language (see migration 0014)
+ALIAS_UNIQUE_VENDORS = ('sqlite', 'postgresql')
+
+
 class Node(models.Model):
     """ Node Model: basic content record """
     page_type = models.ForeignKey(PageType, verbose_name=_("page type"))
@@ -110,12 +116,10 @@ class Node(models.Model):
         """
         return get_full_path(self.link, self.language)
 
-    def save(self, *args, **kwargs):
-        """ Override save method to format alias
-        After calling parent save, use update in order to avoid issues with new records that get assigned an id
-        Not used signals to avoid recursion issues
-        :param args
-        :param kwargs
+    def format_alias(self):
+        """ Format the alias from the page type url pattern, if no alias is specified
+        Performed before save, so that the alias is written along with the record
+        `[node:id]` can only be replaced for existing nodes; for new nodes it is replaced after insert
         :return: None
         """
         if not self.alias and self.page_type.url_pattern:
@@ -127,13 +131,110 @@ class Node(models.Model):
                 date_field = self.created if dates.group(1) == 'created' else self.changed
                 date_field = DateFormat(date_field).format(dates.group(2))
                 self.alias = self.alias.replace(dates.group(0), date_field)
-        super(Node, self).save(*args, **kwargs)
-        if self.alias.find('[node:id]') >= 0:
+        if self.id is not None:
             self.alias = self.alias.replace('[node:id]', str(self.id))
-            Node.objects.filter(id=self.id).update(alias=self.alias)
-        if self.alias and Node.objects.filter(alias=self.alias).filter(language=self.language).count() > 1:
-            self.alias = '%s/%d' % (self.alias, self.id)
-            Node.objects.filter(id=self.id).update(alias=self.alias)
+
+    def alias_taken(self, alias, using):
+        """ Check if an alias is used by another node of the same language
+        :param alias: the alias to check
+        :param using: the database alias
+        :return: boolean
+        """
+        return Node.objects.using(using).filter(alias=alias, language=self.language).exclude(id=self.id).exists()
+
+    def alias_candidates(self, alias):
+        """ Get the aliases to try in turn, until one is not used by another node of the same language
+        The alias itself, then with the node id appended, then with an increasing suffix, eg about, about/12, about/12-2
+        The node id is kept as `[node:id]`, as it is not known before a new node is inserted
+        :param alias: the formatted alias
+        :return: a generator of aliases
+        """
+        yield alias
+        if '[node:id]' not in alias:
+            alias = '%s/[node:id]' % alias
+            yield alias
+        for suffix in itertools.count(2):
+            yield '%s-%d' % (alias, suffix)
+
+    def resolve_alias(self, candidates, using, write):
+        """ Write the node with the first of the candidate aliases that is not used by another node
+        On databases with the unique alias index, each write is tried in a savepoint and the next alias on conflict;
+        otherwise each alias is checked before the write
+        :param candidates: an iterable of aliases
+        :param using: the database alias
+        :param write: a callable that writes the node with its current alias
+        :return: True if written, False if all candidates are used
+        """
+        unique = connections[using].vendor in ALIAS_UNIQUE_VENDORS
+        for alias in candidates:
+            self.alias = alias.replace('[node:id]', str(self.id))
+            if not unique:  # pragma: nocover
+                if not self.alias_taken(self.alias, using):
+                    write()
+                    return True
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    write()
+                return True
+            except IntegrityError:
+                if not self.alias_taken(self.alias, using):
+                    raise
+        return False
+
+    def update_alias(self, using):
+        """ Write the alias of the node with a single update
+        :param using: the database alias
+        :return: None
+        """
+        Node.objects.using(using).filter(id=self.id).update(alias=self.alias)
+
+    def save(self, *args, **kwargs):
+        """ Override save method to format alias
+        The alias is formatted and resolved before save and its uniqueness per language is enforced by a unique index
+        (see migration 0014), so that a save is a single write that is safe under concurrency
+        If the alias is already used, the save is retried with the next alias of `alias_candidates`
+        New nodes that require their id in the alias are inserted without alias and their alias is written
+        right after the insert, in the same transaction, before `post_save` is sent (see `_save_table`),
+        so that receivers and the instance always see the final alias
+        On databases without partial indexes, duplicates are checked before save
+        Not used signals to avoid recursion issues
+        :param args
+        :param kwargs
+        :return: None
+        """
+        self.format_alias()
+        self._pending_alias = None
+        using = kwargs.get('using') or router.db_for_write(Node, instance=self)
+        write = partial(super(Node, self).save, *args, **kwargs)
+        if not self.alias:
+            write()
+            return
+        candidates = self.alias_candidates(self.alias)
+        if self.id is None:
+            alias = next(candidates)
+            if '[node:id]' not in alias:
+                if self.resolve_alias((alias,), using, write):
+                    return
+                alias = next(candidates)
+            # the alias requires the id of a new node: insert without alias, which is not indexed, see `_save_table`
+            self.alias = ''
+            self._pending_alias = itertools.chain((alias,), candidates)
+            write()
+            return
+        self.resolve_alias(candidates, using, write)
+
+    def _save_table(self, raw=False, cls=None, force_insert=False, force_update=False, using=None,
+                    update_fields=None):
+        """ Write the record; if the alias of a new node requires its id, write the alias right after the insert
+        This runs within the save transaction and before `post_save` is sent
+        :return: True if the record has been updated, False if inserted
+        """
+        updated = super(Node, self)._save_table(raw, cls, force_insert, force_update, using, update_fields)
+        candidates, self._pending_alias = getattr(self, '_pending_alias', None), None
+        if candidates is not None:
+            self.resolve_alias(candidates, using, partial(self.update_alias, using))
+        return updated
 
     class Meta:
         """ Model meta """
@@ -191,11 +292,16 @@ class MenuItem(MPTTModel):
         """
         return str(self.title)
 
+    # precomputed full path, set on the items of compiled menu trees (see `ninecms.utils.menus`)
+    _full_path = None
+
     def full_path(self):
         """ Get the full path including language (if any) and path
         @see 9cms_menu_full_path.ods
         :return: full path string
         """
+        if self._full_path is not None:
+            return self._full_path
         path = self.path
         if path.startswith('http:') or path.startswith('https:'):
             return path
@@ -413,3 +519,26 @@ class TaxonomyTerm(MPTTModel):
         """ Model meta """
         verbose_name = _("taxonomy term")
         verbose_name_plural = _("taxonomy terms")
+
+"""
+Search System
+"""
+
+
+class SearchToken(models.Model):
+    """ Search Token Model: inverted index of node content, maintained on node save (see `ninecms.utils.search`) """
+    token = models.CharField(max_length=100, verbose_name=_("token"))
+    node = models.ForeignKey(Node, related_name='search_tokens', verbose_name=_("node"))
+    weight = models.IntegerField(default=1, verbose_name=_("weight"))
+
+    def __str__(self):
+        """ Get model name
+        :return: model name
+        """
+        return str(self.token)
+
+    class Meta:
+        """ Model meta """
+        unique_together = ('token', 'node')
+        verbose_name = _("search token")
+        verbose_name_plural = _("search tokens")
@@ -316,15 +316,119 @@ IMAGE_STYLES = {
 # Update image styles in project settings such as:
 # IMAGE_STYLES.update({})
 
+# Backend to generate image styles: ImageMagickBackend (requires imagemagick) or PillowBackend (in process)
+IMAGE_STYLES_BACKEND = 'ninecms.utils.imaging.ImageMagickBackend'
+
+# Maximum number of images to keep existing image style urls for in each process (entries are also kept in the cache)
+IMAGE_STYLES_MEMO_SIZE = 10000
+
+# Path file name of the image styles manifest under media root, used by `manage.py ninecms_image_styles`
+IMAGE_STYLES_MANIFEST = 'ninecms/image_styles.json'
+
+# Run background tasks such as image style generation in a worker pool; if False run them immediately
+TASKS_ASYNC = True
+
+# Number of background worker threads
+TASKS_WORKERS = 2
+
+# Send the signals of signal blocks concurrently in a worker pool; if False send them in order
+# Receivers then run on separate database connections, outside of the request transaction
+BLOCK_SIGNALS_PARALLEL = False
+
+# Number of worker threads for signal blocks
+BLOCK_SIGNALS_WORKERS = 4
+
+# Time (seconds) to wait for each signal block; on timeout the last result of the block is used
+BLOCK_SIGNALS_TIMEOUT = 2
+
+# Define sanitize policies for html input: allowed tags, attributes per tag and css properties
+# The 'basic' policy is used for content by default and 'full' for users with the 'use full html' permission
+SANITIZE_POLICIES = {
+    'basic': {
+        'tags': ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'strong', 'ul',
+                 'cite', 'dl', 'dt', 'dd', 'p', 'u', 's', 'sub', 'sup', 'img',
+                 'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'iframe',
+                 'h2', 'h3', 'h4', 'h5', 'h6', 'span', 'br'],
+        'attributes': {
+            'a': ['href', 'title', 'name', 'target', 'class'],
+            'abbr': ['title'],
+            'acronym': ['title'],
+            'p': ['style', 'class'],
+            'img': ['src', 'alt', 'title', 'class'],
+            'iframe': ['src', 'height', 'width', 'class'],
+            'table': ['border', 'cellpadding', 'cellspacing'],
+            'th': ['scope', 'rowspan', 'colspan', 'class'],
+            'td': ['scope', 'rowspan', 'colspan', 'class'],
+            'span': ['style', 'class'],
+            'div': ['style', 'class'],
+        },
+        'styles': ['margin-left', 'text-align', 'width', 'page-break-after', 'display', 'float'],
+    },
+}
+SANITIZE_POLICIES['full'] = dict(SANITIZE_POLICIES['basic'], tags=SANITIZE_POLICIES['basic']['tags'] + ['div'])
+
+# Add sanitize policies in project settings such as:
+# SANITIZE_POLICIES.update({})
+
 # Define characters to remove at transliteration
 TRANSLITERATE_REMOVE = '"\'`,:;|{[}]+=*&%^$#@!~()?<>'
 
 # Define characters to replace at transliteration
 TRANSLITERATE_REPLACE = (' .-_/', '-----')
 
+# Define additional transliteration mappings per language, eg {'uk': {'є': 'je', 'ї': 'ji'}}
+# These have priority over the built-in mappings
+TRANSLITERATE_LANGUAGES = {}
+
 # Define language menu labels
 # Possible values: name, code, flag
 LANGUAGE_MENU_LABELS = 'name'
 
 # Enable i18n urls for 9cms
 I18N_URLS = True
+
+# Cache timeout (seconds) of url alias resolutions
+ALIAS_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Cache timeout (seconds) of url aliases not found (404), kept short
+ALIAS_NOT_FOUND_CACHE_TIMEOUT = 5 * 60
+
+# Number of nodes written per update statement when regenerating url aliases in bulk
+ALIAS_REGENERATE_CHUNK_SIZE = 500
+
+# Search backend for the search results block
+# The database backend uses FTS5 on SQLite and tsvector on PostgreSQL, otherwise the token index
+# 'ninecms.utils.search.TokenSearchBackend' uses the token index on any database
+# 'ninecms.utils.search.SimpleSearchBackend' searches without index, scanning the node table
+SEARCH_BACKEND = 'ninecms.utils.search.DatabaseSearchBackend'
+
+# Weight of a token per node field in which it appears, for ranking search results
+SEARCH_FIELD_WEIGHTS = {'title': 10, 'highlight': 5, 'summary': 3, 'body': 1}
+
+# Number of results per page of the search results block
+SEARCH_RESULTS_PER_PAGE = 10
+
+# Maximum number of search results that can be paged through
+SEARCH_RESULTS_MAX = 1000
+
+# Maximum length (characters) of the text snippet of a search result
+SEARCH_SNIPPET_LENGTH = 200
+
+# Cache timeout (seconds) of search result pages; invalidated on any node change
+SEARCH_CACHE_TIMEOUT = 10 * 60
+
+# Cache rendered pages; invalidated on any change of the node, its media, blocks, menus or terms
+PAGE_CACHE = True
+
+# Cache timeout (seconds) of rendered pages
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Also cache rendered pages for authenticated users (a separate variant for each user)
+PAGE_CACHE_AUTHENTICATED = False
+
+# Cache timeout (seconds) of rendered static blocks; keys change along with the node anyway
+STATIC_BLOCK_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Select and compile the templates of all page types on the first request of each process,
+# so that the first request of each page type is not delayed
+PAGE_TEMPLATES_WARM = False
@@ -5,12 +5,17 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django import dispatch
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import User, Group
 # noinspection PyPackageRequirements
-from guardian.models import GroupObjectPermission
-from ninecms.models import TaxonomyTerm, Node, PageType, Video, Image, File
-from ninecms.utils.media import delete_all
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from ninecms.models import TaxonomyTerm, Node, PageType, Video, Image, File, ContentBlock, MenuItem
+from ninecms.utils.media import delete_on_commit, generate_styles, forget_image_styles
+from ninecms.utils.tasks import submit
+from ninecms.utils.cache import invalidate
+from ninecms.utils.blocks import block_cache
+from ninecms.utils.search import get_backend as get_search_backend
 
 
 # noinspection PyUnusedLocal
@@ -18,7 +23,6 @@ from ninecms.utils.media import delete_all
 def pre_delete_tasks(sender, instance, **kwargs):
     """ Delete all relevant permissions from guardian as there is no foreign key to the object
     http://django-guardian.readthedocs.org/en/stable/userguide/caveats.html
-    Delete the respective file when an image, a video or a file record is to be deleted
     :param sender: the model to be deleted
     :param instance: the page type object to be deleted
     :param kwargs: other arguments
@@ -27,20 +31,197 @@ def pre_delete_tasks(sender, instance, **kwargs):
     if sender == PageType:
         content_type = ContentType.objects.get_for_model(instance)
         GroupObjectPermission.objects.filter(content_type=content_type, object_pk=instance.pk).delete()
-    elif sender == Image:
-        delete_all(instance.image.path)
+
+
+# noinspection PyUnusedLocal
+def delete_media_files(sender, instance, **kwargs):
+    """ Delete the respective file and its image style derivatives when an image, a video or a file has been deleted
+    Removal is deferred until the transaction is committed and then runs in the background workers,
+    so that deletes return quickly and files are kept if the transaction is rolled back
+    All files deleted in a transaction, eg by a queryset delete, are removed by a single task (see `delete_on_commit`)
+    :param sender: the media model
+    :param instance: the media object deleted
+    :param kwargs: other arguments
+    :return: None
+    """
+    if sender == Image:
+        forget_image_styles(instance.image.name)
+        path, styles = instance.image.path, None
     elif sender == Video:
-        delete_all(instance.video.path)
-    elif sender == File:
-        delete_all(instance.file.path)
+        path, styles = instance.video.path, ()
+    else:
+        path, styles = instance.file.path, ()
+    delete_on_commit(path, styles, kwargs.get('using'))
+
+
+# noinspection PyUnusedLocal
+@dispatch.receiver(post_save, sender=Image)
+def image_saved(sender, instance, **kwargs):
+    """ Generate all image style derivatives of an uploaded image in the background
+    :param sender: the image model
+    :param instance: the image object saved
+    :param kwargs: other arguments
+    :return: None
+    """
+    if instance.image:
+        forget_image_styles(instance.image.name)
+        submit(generate_styles, instance.image.path, key=(instance.image.path, None))
+
+
+def invalidate_nodes(node_ids):
+    """ Invalidate all cached content that depends on the given nodes
+    Called on node save and delete; should also be called after bulk updates that send no signals, eg `update()`
+    Page layouts are invalidated only if any of the nodes is rendered in a static block
+    Signal blocks and search results may list any nodes, so they are invalidated as well
+    :param node_ids: an iterable of node ids (can be a lazy values_list)
+    :return: None
+    """
+    node_ids = list(node_ids)
+    tags = ['alias', 'signal', 'search'] + ['node:%d' % node_id for node_id in node_ids]
+    if ContentBlock.objects.filter(node_id__in=node_ids).exists():
+        tags.append('layout')
+    invalidate(*tags)
+
+
+# noinspection PyUnusedLocal
+def node_changed(sender, instance, **kwargs):
+    """ Invalidate cached content on node save or delete
+    :param sender: the node model
+    :param instance: the node saved or deleted
+    :param kwargs: other arguments
+    :return: None
+    """
+    invalidate_nodes((instance.pk,))
+
+
+# noinspection PyUnusedLocal
+def node_indexed(sender, instance, **kwargs):
+    """ Update the search index of a node on save; tokens are deleted along with the node
+    :param sender: the node model
+    :param instance: the node saved
+    :param kwargs: other arguments
+    :return: None
+    """
+    get_search_backend().index(instance)
+
+
+# noinspection PyUnusedLocal
+def node_unindexed(sender, instance, **kwargs):
+    """ Remove a deleted node from the search index
+    :param sender: the node model
+    :param instance: the node deleted
+    :param kwargs: other arguments
+    :return: None
+    """
+    get_search_backend().remove(instance.pk)
+
+
+# noinspection PyUnusedLocal
+def media_changed(sender, instance, **kwargs):
+    """ Invalidate the cached pages of a node when an image, a file or a video of the node is changed
+    Pages that render the node in a static block or in a signal block are invalidated as well (see `invalidate_nodes`)
+    :param sender: the media model
+    :param instance: the media object saved or deleted
+    :param kwargs: other arguments
+    :return: None
+    """
+    invalidate_nodes((instance.node_id,))
+
+
+# noinspection PyUnusedLocal
+def term_changed(sender, instance, **kwargs):
+    """ Invalidate cached content when a taxonomy term or its nodes are changed
+    :param sender: the term model or the term-nodes relation
+    :param instance: the term (or node if the relation is changed from the node side)
+    :param kwargs: other arguments
+    :return: None
+    """
+    if isinstance(instance, Node):
+        node_ids = [instance.pk]
+    else:
+        node_ids = list(instance.nodes.values_list('pk', flat=True)) + list(kwargs.get('pk_set') or ())
+    invalidate('signal', *['node:%d' % node_id for node_id in node_ids])
+
+
+# noinspection PyUnusedLocal
+def layout_changed(sender, **kwargs):
+    """ Invalidate compiled page layouts when a block or a page type is changed
+    :param sender: the model changed
+    :param kwargs: other arguments
+    :return: None
+    """
+    invalidate('layout')
+
+
+# noinspection PyUnusedLocal
+def menu_changed(sender, **kwargs):
+    """ Invalidate compiled menu trees and page layouts when a menu item is changed
+    :param sender: the menu item model
+    :param kwargs: other arguments
+    :return: None
+    """
+    invalidate('menu', 'layout')
+
+post_save.connect(node_changed, sender=Node)
+post_delete.connect(node_changed, sender=Node)
+post_save.connect(node_indexed, sender=Node)
+post_delete.connect(node_unindexed, sender=Node)
+for model in (Image, File, Video):
+    post_save.connect(media_changed, sender=model)
+    post_delete.connect(media_changed, sender=model)
+    post_delete.connect(delete_media_files, sender=model)
+post_save.connect(term_changed, sender=TaxonomyTerm)
+pre_delete.connect(term_changed, sender=TaxonomyTerm)
+m2m_changed.connect(term_changed, sender=TaxonomyTerm.nodes.through)
+for model in (ContentBlock, PageType):
+    post_save.connect(layout_changed, sender=model)
+    post_delete.connect(layout_changed, sender=model)
+post_save.connect(menu_changed, sender=MenuItem)
+post_delete.connect(menu_changed, sender=MenuItem)
+m2m_changed.connect(layout_changed, sender=ContentBlock.page_types.through)
+
+
+# noinspection PyUnusedLocal
+def perms_changed(sender, **kwargs):
+    """ Invalidate the permission snapshots of all users when object or group permissions or page types change
+    :param sender: the model changed
+    :param kwargs: other arguments
+    :return: None
+    """
+    invalidate('perms')
+
+
+# noinspection PyUnusedLocal
+def user_perms_changed(sender, instance, **kwargs):
+    """ Invalidate the permission snapshots of users whose groups or status change
+    :param sender: the user model or the user-groups relation
+    :param instance: the user, or the group if the relation is changed from the group side
+    :param kwargs: other arguments
+    :return: None
+    """
+    if isinstance(instance, User):
+        invalidate('perms:user:%d' % instance.pk)
+    elif kwargs.get('pk_set'):
+        invalidate(*['perms:user:%d' % pk for pk in kwargs['pk_set']])
+    else:
+        invalidate('perms')
 
+for model in (GroupObjectPermission, UserObjectPermission, PageType):
+    post_save.connect(perms_changed, sender=model)
+    post_delete.connect(perms_changed, sender=model)
+m2m_changed.connect(perms_changed, sender=Group.permissions.through)
+m2m_changed.connect(perms_changed, sender=User.user_permissions.through)
+m2m_changed.connect(user_perms_changed, sender=User.groups.through)
+post_save.connect(user_perms_changed, sender=User)
 
 block_signal = dispatch.Signal(providing_args=['view', 'request'])
 
 
+@block_cache('terms', vary_on=(), models=(TaxonomyTerm,))
 @dispatch.receiver(block_signal)
 def render_view(**kwargs):
     """ Example of custom views
+    The result of the 'terms' view is cached until a term changes (see `block_cache`)
     :param kwargs: 'view' contains the CMS view to render
     :return: None
     """
@@ -7,9 +7,12 @@ __email__ = 'gkarak@9-dev.com'
 from django import template
 from django.template.defaultfilters import stringfilter
 from django.template import Context
+from django.utils.safestring import mark_safe
 from ninecms.utils.media import image_style as util_image
 from ninecms.utils.transliterate import upper_no_intonation as util_upper
 from ninecms.utils.nodes import get_clean_url
+from ninecms.utils.menus import MenuTree
+from ninecms.utils.fragments import render_static
 from ninecms.utils import status
 
 
@@ -109,9 +112,14 @@ def active_trail(menu, url):
     Also remove language part from url if i18n urls are enabled
     :param menu: the parent menu
     :param url: the current url to check against for the active path (should be request.path)
-    :return: a recordset of all active menu ancestors
+    :return: a recordset of all active menu ancestors; a list if the menu is a compiled menu tree
     """
-    return menu.filter(path=get_clean_url(url)).get_ancestors(include_self=True) if menu else []
+    if not menu:
+        return []
+    path = get_clean_url(url)
+    if isinstance(menu, MenuTree):
+        return menu.active_trail(path)
+    return menu.filter(path=path).get_ancestors(include_self=True)
 
 
 @register.filter
@@ -121,6 +129,8 @@ def flatten(records, fld):
     :param fld: the field from the records to include in list
     :return: a list
     """
+    if isinstance(records, list):
+        return [getattr(record, fld) for record in records]
     return [path for fields in records.values_list(fld) for path in fields] if records else []
 
 
@@ -147,6 +157,15 @@ def check_path_active(node_path, request_path):
     url = get_clean_url(request_path)
     return node_path == url or node_path == url.strip('/')
 
+@register.simple_tag
+def static_block(node, classes=''):
+    """ Render a static block as a cached fragment (see `render_static`)
+    :param node: the node of the block
+    :param classes: additional classes for the block
+    :return: the rendered html
+    """
+    return mark_safe(render_static(node, classes))
+
 @register.inclusion_tag('ninecms/glyphicon.html')
 def glyphicon(icon):
     """ Shorthand for bootstrap glyphicon markup
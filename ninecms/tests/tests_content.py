@@ -8,21 +8,49 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.template import loader, Template, Context
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, IntegrityError
+from django.db.models.signals import post_save
+from django.core.signals import request_started
 from django.core.urlresolvers import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, AnonymousUser, Group
 from django.utils import translation
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from ninecms.models import Node, image_path_file_name, file_path_file_name, video_path_file_name, PageType
+from django.core.management import call_command, CommandError
+from ninecms.models import Node, image_path_file_name, file_path_file_name, video_path_file_name, PageType, Image, \
+    SearchToken, ContentBlock, TaxonomyTerm
+from ninecms.signals import block_signal
 from ninecms.utils.transliterate import transliterate
 from django.utils.dateformat import DateFormat
 from ninecms.forms import ContactForm, SearchForm
 from ninecms.templatetags import ninecms_extras
+from ninecms.utils.layout import get_page_layout
+from ninecms.utils.cache import TaggedCache, tag_key
+from ninecms.utils.menus import get_menu_tree
+from ninecms.utils.templates import get_page_template, warm_page_templates, reset_page_templates, \
+    warm_on_first_request, _templates
+from ninecms.utils.blocks import send_signal_blocks, block_cache, LazyBlock
+from ninecms.utils import blocks
+from ninecms.utils.render import NodeView
+from ninecms.utils.search import tokenize, get_backend as get_search_backend, SqliteSearchBackend, snippet, \
+    search_page
+from ninecms.utils.media import style_path_file_name, style_url, generate_style, manifest_path_file_name, \
+    forget_image_styles
 from ninecms.tests.setup import create_front, create_basic, create_menu, create_block_static, create_block_menu, \
     create_block_signal_terms, create_block_simple, create_page, create_image, create_file, \
     create_video, create_terms, assert_front, assert_basic, create_user, assert_image, data_contact, get_front_title, \
     data_login, url_with_lang
+# noinspection PyPackageRequirements
+from PIL import Image as PilImage
+from io import StringIO
+import threading
+import shutil
+import time
+import os
 
 
 class ContentTests(TestCase):
@@ -96,6 +124,15 @@ class ContentTests(TestCase):
                          'xeskepazo_tin_psychofthora_bdelygmia.doc')
         self.assertEqual(ninecms_extras.upper_no_intonation("Σχετικά"), "ΣΧΕΤΙΚΑ")
 
+    def test_transliterate_languages(self):
+        """ Test transliteration with additional languages from settings
+        :return: None
+        """
+        self.assertEqual(transliterate("Київ"), 'Kiїv')
+        with self.settings(TRANSLITERATE_LANGUAGES={'uk': {'ї': 'ji', 'и': 'y'}}):
+            self.assertEqual(transliterate("Київ"), 'Kyjiv')
+        self.assertEqual(transliterate("Київ"), 'Kiїv')
+
     def test_node_view_with_front(self):
         """ Test node view for front page
         Test simple
@@ -179,6 +216,192 @@ class ContentTests(TestCase):
         node = Node.objects.create(page_type=page_type, title="Test aliases node", user=self.node_rev_basic.node.user)
         self.assertEqual(node.alias, 'test/test-aliases-node/%d' % node.id)
 
+    def test_node_aliases_unique(self):
+        """ Test that aliases are unique per language, enforced by the database and resolved with a single write
+        :return: None
+        """
+        page_type = PageType.objects.create(name='test_aliases_unique', description="Test aliases unique",
+                                            url_pattern='unique/[node:title]')
+        user = self.node_rev_basic.node.user
+        with CaptureQueriesContext(connection) as queries:
+            node = Node.objects.create(page_type=page_type, title="Unique", user=user)
+        node_writes = ('INSERT INTO "ninecms_node"', 'UPDATE "ninecms_node"')
+        self.assertEqual(len([q for q in queries if q['sql'].startswith(node_writes)]), 1)
+        self.assertEqual(node.alias, 'unique/unique')
+        other = Node.objects.create(page_type=page_type, title="Other", user=user)
+        other.alias = 'unique/unique'
+        other.save()
+        self.assertEqual(Node.objects.get(id=other.id).alias, 'unique/unique/%d' % other.id)
+        translated = Node.objects.create(page_type=page_type, title="Unique", user=user, language='el')
+        self.assertEqual(translated.alias, 'unique/unique')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Node.objects.filter(id=other.id).update(alias='unique/unique')
+        # post_save receivers see the resolved alias of a new node, as written
+        aliases = []
+
+        # noinspection PyUnusedLocal
+        def saved(sender, instance, **kwargs):
+            aliases.append((instance.alias, Node.objects.get(id=instance.id).alias))
+
+        post_save.connect(saved, sender=Node)
+        try:
+            duplicate = Node.objects.create(page_type=page_type, title="Unique", user=user)
+        finally:
+            post_save.disconnect(saved, sender=Node)
+        self.assertEqual(duplicate.alias, 'unique/unique/%d' % duplicate.id)
+        self.assertEqual(aliases, [(duplicate.alias, duplicate.alias)])
+        # an alias with the id appended may be used as well, then a suffix is appended
+        other.alias = 'unique/unique/%d' % (duplicate.id + 1)
+        other.save()
+        taken = Node.objects.create(page_type=page_type, title="Unique", user=user)
+        self.assertEqual(taken.id, duplicate.id + 1)
+        self.assertEqual(Node.objects.get(id=taken.id).alias, 'unique/unique/%d-2' % taken.id)
+        translated.alias = 'unique/unique/%d' % other.id
+        translated.language = ''
+        translated.save()
+        other.alias = 'unique/unique'
+        other.save()
+        self.assertEqual(Node.objects.get(id=other.id).alias, 'unique/unique/%d-2' % other.id)
+
+    def test_command_reset_aliases(self):
+        """ Test command to regenerate aliases in bulk, with collisions within the batch and swapped aliases
+        :return: None
+        """
+        page_type = PageType.objects.create(name='test_aliases_bulk', description="Test aliases bulk",
+                                            url_pattern='bulk/[node:title]')
+        user = self.node_rev_basic.node.user
+        first = Node.objects.create(page_type=page_type, title="Bulk", user=user, alias='other')
+        second = Node.objects.create(page_type=page_type, title="Bulk", user=user)
+        third = Node.objects.create(page_type=page_type, title="Bulk", user=user, alias='bulk/bulk/moved')
+        self.assertEqual(second.alias, 'bulk/bulk')
+        out = StringIO()
+        call_command('ninecms_reset_aliases', page_types=['test_aliases_bulk'], dry_run=True, stdout=out)
+        self.assertIn("3 nodes processed, 3 aliases would change.", out.getvalue())
+        self.assertEqual(Node.objects.get(id=first.id).alias, 'other')
+        out = StringIO()
+        call_command('ninecms_reset_aliases', page_types=['test_aliases_bulk'], chunk_size=1, stdout=out)
+        self.assertIn("3/3 aliases written.", out.getvalue())
+        self.assertIn("3 nodes processed, 3 aliases changed.", out.getvalue())
+        self.assertEqual(Node.objects.get(id=first.id).alias, 'bulk/bulk')
+        self.assertEqual(Node.objects.get(id=second.id).alias, 'bulk/bulk/%d' % second.id)
+        self.assertEqual(Node.objects.get(id=third.id).alias, 'bulk/bulk/%d' % third.id)
+        out = StringIO()
+        call_command('ninecms_reset_aliases', page_types=['test_aliases_bulk'], stdout=out)
+        self.assertIn("3 nodes processed, 0 aliases changed.", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('ninecms_reset_aliases', page_types=['not_exists'], stdout=StringIO())
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-alias-resolution'}})
+    def test_alias_resolution_cache(self):
+        """ Test that alias resolutions are cached, including aliases not found, and invalidated on node save
+        :return: None
+        """
+        url = url_with_lang('/alias-resolution/')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        create_basic('alias-resolution')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-page-cache'}},
+                       MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if '.cache.' not in m])
+    def test_page_cache(self):
+        """ Test that anonymous pages are served from cache and invalidated on node, media and block changes
+        :return: None
+        """
+        node = self.node_rev_basic.node
+        url = url_with_lang('/about/')
+        self.assertContains(self.client.get(url), node.title)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), node.title)
+        node.title = "About cached"
+        node.save()
+        self.assertContains(self.client.get(url), "About cached")
+        for change in (lambda: Image.objects.create(node=node, image='ninecms/basic/image/test.png'),
+                       lambda: create_block_simple(node.page_type, 'page-cache-test')):
+            change()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertNotEqual(len(queries), 0)
+            with self.assertNumQueries(0):
+                self.client.get(url)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-page-cache-static-media'}},
+                       MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if '.cache.' not in m],
+                       IMAGE_STYLES_BACKEND='ninecms.utils.imaging.PillowBackend')
+    def test_page_cache_static_block_media(self):
+        """ Test that cached pages are invalidated on media changes of a node rendered in a static block
+        :return: None
+        """
+        node = Node.objects.get(pk=self.node_rev_basic.node_id)
+        self.generate_large_styles(node)
+        node_rev = create_page('sidebar', "Sidebar page", 'sidebar', '', "Sidebar")
+        create_block_static(node_rev.node.page_type, node)
+        url = url_with_lang('/sidebar/')
+        self.assertContains(self.client.get(url), node.body)
+        with self.assertNumQueries(0):
+            self.assertNotContains(self.client.get(url), "Sidebar image")
+        img = Image.objects.create(node=node, image='ninecms/basic/image/test.png', title="Sidebar image")
+        self.assertContains(self.client.get(url), 'alt="Sidebar image"')
+        img.delete()
+        self.assertNotContains(self.client.get(url), "Sidebar image")
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-page-cache-signal-models'}},
+                       MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if '.cache.' not in m])
+    def test_page_cache_signal_block_models(self):
+        """ Test that cached pages are invalidated on changes of the models of a signal block cache policy only
+        :return: None
+        """
+        # noinspection PyUnusedLocal
+        def groups_view(**kwargs):
+            if kwargs['view'] == 'groups':
+                return list(Group.objects.values_list('name', flat=True))
+
+        block_signal.connect(block_cache('groups', vary_on=(), models=(Group,))(groups_view))
+        try:
+            node_rev = create_page('sidebar', "Sidebar page", 'sidebar', '', "Sidebar")
+            block = ContentBlock.objects.create(name='signal-groups', type='signal', signal='groups')
+            block.page_types.add(node_rev.node.page_type)
+            url = url_with_lang('/sidebar/')
+            self.assertNotContains(self.client.get(url), "Cached group")
+            with self.assertNumQueries(0):
+                self.client.get(url)
+            Group.objects.create(name="Cached group")
+            self.assertContains(self.client.get(url), "<p>Cached group</p>")
+            # the view declares its models, so the page does not depend on the 'signal' tag of any node change
+            Node.objects.create(page_type=node_rev.node.page_type, title="Unrelated", user=node_rev.node.user)
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), "<p>Cached group</p>")
+        finally:
+            block_signal.disconnect(groups_view)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-tag-eviction'}})
+    def test_cache_tag_eviction(self):
+        """ Test that entries are not valid anymore if the version of their tag has been evicted
+        :return: None
+        """
+        tagged_cache = TaggedCache('test-eviction', tags=('eviction',))
+        tagged_cache.set('key', 'value', tagged_cache.versions())
+        self.assertEqual(tagged_cache.get('key'), 'value')
+        cache.delete(tag_key('eviction'))
+        self.assertIsNone(tagged_cache.get('key'))
+
+    def generate_large_styles(self, node):
+        """ Generate the large style derivatives of the images of a node, that static blocks render,
+        so that the blocks are cached (see `image_style`); the derivatives are removed on cleanup
+        :param node: the node
+        :return: None
+        """
+        forget_image_styles()
+        for img in node.image_set.all():
+            self.addCleanup(os.remove, generate_style(img.image.path, 'large'))
+
     """ Menu System """
     def test_menu_model_methods(self):
         """ Test menu model methods
@@ -205,6 +428,94 @@ class ContentTests(TestCase):
             self.assertContains(response, '<div class="body">About ' + str(i) + ' page.</div>')
         self.assertNotContains(response, '<div class="body">About 4 page.</div>')
 
+    def test_page_layout_cache(self):
+        """ Test that page layouts are compiled once and invalidated on block changes
+        :return: None
+        """
+        page_type_id = self.node_rev_front.node.page_type_id
+        layout = get_page_layout(page_type_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_page_layout(page_type_id).blocks, layout.blocks)
+            self.assertEqual(dict(layout.blocks)['static_about'].node, self.node_rev_basic.node)
+        block = create_block_simple(self.node_rev_front.node.page_type, 'layout-test')
+        self.assertIn(('layout_test', block), get_page_layout(page_type_id).blocks)
+        block.delete()
+        self.assertNotIn(('layout_test', block), get_page_layout(page_type_id).blocks)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-static-block-cache'}},
+                       IMAGE_STYLES_BACKEND='ninecms.utils.imaging.PillowBackend')
+    def test_static_block_cache(self):
+        """ Test that static blocks are rendered once per node change and invalidated on media changes
+        :return: None
+        """
+        node = self.node_rev_basic.node
+        self.generate_large_styles(node)
+        t = loader.get_template('ninecms/block_static.html')
+        html = t.render({'node': node})
+        self.assertIn('<div class="body">%s</div>' % node.body, html)
+        with self.assertNumQueries(0):
+            self.assertEqual(t.render({'node': node}), html)
+        self.assertNotEqual(t.render({'node': node, 'classes': 'footer'}), html)
+        Image.objects.create(node=node, image='ninecms/basic/image/test.png', title="Static block image")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn('alt="Static block image"', t.render({'node': node}))
+        self.assertEqual(len(queries), 2)
+        node.body = "<p>Static block changed</p>"
+        node.save()
+        self.assertIn('<p>Static block changed</p>', t.render({'node': node}))
+        self.assertIn('<div class="body"></div>', t.render({'node': None}))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-static-block-placeholder'}},
+                       MIDDLEWARE_CLASSES=[m for m in settings.MIDDLEWARE_CLASSES if '.cache.' not in m],
+                       IMAGE_STYLES_BACKEND='ninecms.utils.imaging.PillowBackend')
+    def test_static_block_cache_placeholder(self):
+        """ Test that static blocks and pages are not cached while an image style derivative is being generated
+        :return: None
+        """
+        node = Node.objects.get(pk=self.img.node_id)
+        node_rev = create_page('sidebar', "Sidebar page", 'sidebar', '', "Sidebar")
+        create_block_static(node_rev.node.page_type, node)
+        style_file = style_path_file_name(self.img.image.path, 'large')
+        if os.path.exists(style_file):
+            os.remove(style_file)
+        forget_image_styles()
+        url = url_with_lang('/sidebar/')
+        t = loader.get_template('ninecms/block_static.html')
+        # generation runs synchronously in tests, after the placeholder has been returned
+        self.assertIn('src="%s"' % self.img.image.url, t.render({'node': node}))
+        self.assertTrue(os.path.exists(style_file))
+        self.assertIn('src="%s"' % style_url(self.img.image.url, 'large'), t.render({'node': node}))
+        os.remove(style_file)
+        forget_image_styles()
+        self.assertContains(self.client.get(url), 'src="%s"' % self.img.image.url)
+        self.assertContains(self.client.get(url), 'src="%s"' % style_url(self.img.image.url, 'large'))
+        shutil.rmtree(os.path.dirname(style_file))
+
+    def test_page_template_cache(self):
+        """ Test that page templates are selected once per page type, warmed and reset with template settings
+        :return: None
+        """
+        reset_page_templates()
+        template = get_page_template(self.node_rev_basic.node.page_type.name)
+        self.assertIs(get_page_template(self.node_rev_basic.node.page_type.name), template)
+        self.assertEqual(template.template.name, 'ninecms/page_basic.html')
+        with self.settings(DEBUG=True):
+            self.assertIsNot(get_page_template(self.node_rev_basic.node.page_type.name), template)
+        self.assertIsNot(get_page_template(self.node_rev_basic.node.page_type.name), template)
+        self.assertEqual(warm_page_templates(), PageType.objects.count())
+
+    def test_page_template_warm_first_request(self):
+        """ Test that page templates are warmed on the first request only, as with `PAGE_TEMPLATES_WARM`
+        :return: None
+        """
+        reset_page_templates()
+        request_started.connect(warm_on_first_request, dispatch_uid='ninecms_warm_page_templates')
+        assert_front(self, reverse('ninecms:index'))
+        self.assertEqual(set(_templates), set(PageType.objects.values_list('name', flat=True)))
+        self.assertFalse(request_started.disconnect(dispatch_uid='ninecms_warm_page_templates'))
+
     def test_node_view_block_menu(self):
         """ Test menu block for front view
         :return: None
@@ -216,6 +527,43 @@ class ContentTests(TestCase):
         self.assertContains(response, '<a href="http://google.com/">')
         self.assertContains(response, '<a href="#bookmark">')
 
+    def test_menu_tree_cache(self):
+        """ Test that menu trees are compiled once with full paths and invalidated on menu item changes
+        :return: None
+        """
+        tree = get_menu_tree(self.menu)
+        with self.assertNumQueries(0):
+            tree = get_menu_tree(self.menu)
+            self.assertEqual([item.title for item in tree], ["Front", "About", "Team", "Google", "A bookmark"])
+            self.assertEqual([item.full_path() for item in tree],
+                             ['/', '/about/', '/about/#team', 'http://google.com/', '#bookmark'])
+            self.assertEqual([item.title for item in ninecms_extras.active_trail(tree, '/en/about/')],
+                             ["Main Menu", "About"])
+            self.assertEqual(ninecms_extras.flatten(ninecms_extras.active_trail(tree, '/en/about/'), 'path'),
+                             ['', 'about'])
+            self.assertEqual(ninecms_extras.active_trail(tree, '/en/not-exists/'), [])
+        item = self.menu.children.first()
+        item.title = "Home"
+        item.save()
+        self.assertEqual([item.title for item in get_menu_tree(self.menu)][0], "Home")
+        item.title = "Front"
+        item.save()
+
+    def test_menu_active_trail_index(self):
+        """ Test that active trail and breadcrumbs are looked up from the menu tree index without queries
+        :return: None
+        """
+        tree = get_menu_tree(self.menu)
+        request = RequestFactory().get('/en/about/')
+        with self.assertNumQueries(0):
+            self.assertEqual(tree.paths['about'], tuple(item.id for item in tree.trail(tree.paths['about'][-1])))
+            breadcrumbs = loader.render_to_string('ninecms/block_menu_breadcrumbs.html',
+                                                  {'menu': tree, 'request': request})
+            header = loader.render_to_string('ninecms/block_menu_header.html', {'menu': tree, 'request': request})
+        self.assertInHTML('<li class="active">About</li>', breadcrumbs)
+        self.assertNotIn("Main Menu", breadcrumbs)
+        self.assertIn('<li class="active-trail active">', header)
+
     def test_node_view_block_menu_root_disabled(self):
         """ Test menu block for front view if root is disabled
         :return: None
@@ -303,6 +651,91 @@ class ContentTests(TestCase):
         ninecms_extras.image_style(self.img_big_portrait.image, 'blog_style')
         assert_image(self, None, self.img_big_portrait, '350x226', 'blog_style')
 
+    @override_settings(IMAGE_STYLES_BACKEND='ninecms.utils.imaging.PillowBackend')
+    def test_image_style_pillow(self):
+        """ Test thumbnail, thumbnail-upscale and thumbnail-crop with the Pillow backend
+        :return: None
+        """
+        for img, style, size in ((self.img, 'thumbnail_upscale', (150, 150)),
+                                 (self.img_big, 'thumbnail', (150, 73)),
+                                 (self.img_big, 'blog_style', (350, 226)),
+                                 (self.img_big_portrait, 'blog_style', (350, 226))):
+            style_file = generate_style(img.image.path, style)
+            with PilImage.open(style_file) as derivative:
+                self.assertEqual(derivative.size, size)
+            # the derivative is written to a temporary file that is moved in place
+            self.assertEqual([name for name in os.listdir(os.path.dirname(style_file)) if name.startswith('.')], [])
+            os.remove(style_file)
+
+    @override_settings(IMAGE_STYLES_BACKEND='ninecms.utils.imaging.PillowBackend',
+                       IMAGE_STYLES_MANIFEST='ninecms/image_styles_test.json')
+    def test_command_image_styles(self):
+        """ Test command to generate image styles, with dry run and resume
+        :return: None
+        """
+        style_file = style_path_file_name(self.img_big.image.path, 'gallery_style')
+        shutil.rmtree(os.path.dirname(style_file), ignore_errors=True)
+        out = StringIO()
+        call_command('ninecms_image_styles', styles=['gallery_style'], dry_run=True, stdout=out)
+        self.assertIn("Dry run: 3 derivatives would be generated.", out.getvalue())
+        self.assertFalse(os.path.exists(style_file))
+        out = StringIO()
+        call_command('ninecms_image_styles', styles=['gallery_style'], concurrency=1, stdout=out)
+        self.assertIn("3 derivatives generated, 0 failed.", out.getvalue())
+        self.assertTrue(os.path.exists(style_file))
+        out = StringIO()
+        call_command('ninecms_image_styles', styles=['gallery_style'], dry_run=True, stdout=out)
+        self.assertIn("Dry run: 0 derivatives would be generated.", out.getvalue())
+        # changing the style definition makes all derivatives stale
+        with self.settings(IMAGE_STYLES=dict(settings.IMAGE_STYLES, gallery_style={'type': 'thumbnail',
+                                                                                   'size': (300, 1000)})):
+            out = StringIO()
+            call_command('ninecms_image_styles', styles=['gallery_style'], dry_run=True, stdout=out)
+            self.assertIn("Dry run: 3 derivatives would be generated.", out.getvalue())
+        # without a manifest (eg on upgrade), derivatives are checked for the size of the current definition
+        os.remove(manifest_path_file_name())
+        out = StringIO()
+        call_command('ninecms_image_styles', styles=['gallery_style'], dry_run=True, stdout=out)
+        self.assertIn("Dry run: 0 derivatives would be generated.", out.getvalue())
+        with self.settings(IMAGE_STYLES=dict(settings.IMAGE_STYLES, gallery_style={'type': 'thumbnail',
+                                                                                   'size': (300, 1000)})):
+            out = StringIO()
+            call_command('ninecms_image_styles', styles=['gallery_style'], dry_run=True, stdout=out)
+            # the small image is not upscaled, so its derivative is the same with either definition
+            self.assertIn("Dry run: 2 derivatives would be generated.", out.getvalue())
+        shutil.rmtree(os.path.dirname(style_file))
+
+    def test_image_style_placeholder(self):
+        """ Test that the original image url is returned until the style derivative is generated
+        Test that existing style urls are memoized
+        :return: None
+        """
+        style_file = style_path_file_name(self.img.image.path, 'placeholder')
+        with override_settings(IMAGE_STYLES={'placeholder': {'type': 'none', 'size': (1, 1)}}):
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'), self.img.image.url)
+            os.makedirs(os.path.dirname(style_file), exist_ok=True)
+            shutil.copy(self.img.image.path, style_file)
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'),
+                             style_url(self.img.image.url, 'placeholder'))
+            # existing style urls are memoized until the image is uploaded or deleted
+            shutil.rmtree(os.path.dirname(style_file))
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'),
+                             style_url(self.img.image.url, 'placeholder'))
+            self.img.save()
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'), self.img.image.url)
+        # the memo is shared by all processes, so an upload or delete in another process is seen as well
+        with override_settings(IMAGE_STYLES={'placeholder': {'type': 'none', 'size': (1, 1)}},
+                               CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                   'LOCATION': 'test-image-style-memo'}}):
+            os.makedirs(os.path.dirname(style_file), exist_ok=True)
+            shutil.copy(self.img.image.path, style_file)
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'),
+                             style_url(self.img.image.url, 'placeholder'))
+            shutil.rmtree(os.path.dirname(style_file))
+            cache.set(tag_key('image:%s' % self.img.image.name), 'another process', None)
+            self.assertEqual(ninecms_extras.image_style(self.img.image, 'placeholder'), self.img.image.url)
+        shutil.rmtree(os.path.dirname(style_file), ignore_errors=True)
+
     """ Taxonomy System """
     def test_model_methods_terms(self):
         """ Test model methods
@@ -319,6 +752,179 @@ class ContentTests(TestCase):
         expected = '<li>Terms<ul><li>Tags<ul class="children"><li>General</li></ul></li></ul></li>'
         self.assertContains(response, expected, html=True)
 
+    @override_settings(BLOCK_SIGNALS_PARALLEL=True, BLOCK_SIGNALS_TIMEOUT=0.5)
+    def test_signal_blocks_parallel(self):
+        """ Test that signal block receivers run concurrently and fall back to their last result on timeout
+        :return: None
+        """
+        delays = {'slow-1': 0.2, 'slow-2': 0.2}
+
+        # noinspection PyUnusedLocal
+        def slow_view(**kwargs):
+            if kwargs['view'] in delays:
+                time.sleep(delays[kwargs['view']])
+                return '%s-%s' % (kwargs['view'], translation.get_language())
+
+        block_signal.connect(slow_view)
+        try:
+            request = RequestFactory().get('/')
+            blocks = [(view, ContentBlock(name=view, type='signal', signal=view)) for view in ('slow-1', 'slow-2')]
+            blocks.append(('terms', self.block_terms))
+            start = time.time()
+            responses = send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)
+            self.assertLess(time.time() - start, 0.4)
+            self.assertEqual(responses['slow-1'], 'slow-1-%s' % settings.LANGUAGE_CODE)
+            self.assertEqual(responses['slow-2'], 'slow-2-%s' % settings.LANGUAGE_CODE)
+            self.assertEqual(list(responses['terms']), list(TaxonomyTerm.objects.all()))
+            self.assertFalse(hasattr(request, 'ninecms_blocks_timed_out'))
+            delays['slow-2'] = 1
+            responses = send_signal_blocks(NodeView, blocks[1:2], self.node_rev_basic.node, request)
+            self.assertEqual(responses['slow-2'], 'slow-2-%s' % settings.LANGUAGE_CODE)
+            self.assertTrue(request.ninecms_blocks_timed_out)
+        finally:
+            block_signal.disconnect(slow_view)
+
+    @override_settings(BLOCK_SIGNALS_PARALLEL=True, BLOCK_SIGNALS_TIMEOUT=0.2)
+    def test_signal_blocks_parallel_fallback_user(self):
+        """ Test that the last results of timed out signal blocks are kept per user
+        :return: None
+        """
+        delays = {'user-block': 0}
+
+        # noinspection PyUnusedLocal
+        def user_view(**kwargs):
+            if kwargs['view'] == 'user-block':
+                time.sleep(delays['user-block'])
+                return 'user-block-%s' % kwargs['request'].user.username
+
+        block_signal.connect(user_view, dispatch_uid='test_user_view')
+        try:
+            blocks = [('user-block', ContentBlock(name='user-block', type='signal', signal='user-block'))]
+            request = RequestFactory().get('/')
+            request.user = create_user()
+            responses = send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)
+            self.assertEqual(responses['user-block'], 'user-block-admin')
+            delays['user-block'] = 0.5
+            request = RequestFactory().get('/')
+            request.user = AnonymousUser()
+            responses = send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)
+            self.assertIsNone(responses['user-block'])
+            self.assertTrue(request.ninecms_blocks_timed_out)
+            request = RequestFactory().get('/')
+            request.user = create_user()
+            responses = send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)
+            self.assertEqual(responses['user-block'], 'user-block-admin')
+            self.assertTrue(request.ninecms_blocks_timed_out)
+        finally:
+            block_signal.disconnect(dispatch_uid='test_user_view')
+
+    @override_settings(BLOCK_SIGNALS_PARALLEL=True, BLOCK_SIGNALS_TIMEOUT=0.1)
+    def test_signal_blocks_parallel_busy(self):
+        """ Test that signal blocks are not queued while all workers are busy, eg with a receiver that hangs
+        :return: None
+        """
+        released = threading.Event()
+
+        # noinspection PyUnusedLocal
+        def busy_view(**kwargs):
+            if kwargs['view'].startswith('hung'):
+                released.wait(5)
+            elif kwargs['view'] == 'quick':
+                return threading.get_ident()
+
+        def wait_idle():
+            deadline = time.time() + 5
+            while blocks._busy and time.time() < deadline:
+                time.sleep(0.01)
+
+        block_signal.connect(busy_view, dispatch_uid='test_busy_view')
+        try:
+            wait_idle()
+            hung = [('hung-%d' % i, ContentBlock(name='hung-%d' % i, type='signal', signal='hung-%d' % i))
+                    for i in range(settings.BLOCK_SIGNALS_WORKERS)]
+            quick = [('quick', ContentBlock(name='quick', type='signal', signal='quick'))]
+            request = RequestFactory().get('/')
+            responses = send_signal_blocks(NodeView, hung, self.node_rev_basic.node, request)
+            self.assertEqual(set(responses.values()), {None})
+            self.assertTrue(request.ninecms_blocks_timed_out)
+            # all workers hang, so the signal is sent in the request thread instead of waiting for the timeout
+            request = RequestFactory().get('/')
+            self.assertEqual(send_signal_blocks(NodeView, quick, self.node_rev_basic.node, request)['quick'],
+                             threading.get_ident())
+            self.assertFalse(hasattr(request, 'ninecms_blocks_timed_out'))
+            released.set()
+            wait_idle()
+            self.assertNotEqual(send_signal_blocks(NodeView, quick, self.node_rev_basic.node, request)['quick'],
+                                threading.get_ident())
+        finally:
+            released.set()
+            block_signal.disconnect(dispatch_uid='test_busy_view')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-signal-block-cache'}})
+    def test_signal_blocks_cache(self):
+        """ Test that results of signal views with a cache policy are cached and invalidated on model changes
+        :return: None
+        """
+        calls = []
+
+        # noinspection PyUnusedLocal
+        def count_view(**kwargs):
+            calls.append(kwargs['view'])
+
+        block_signal.connect(count_view)
+        try:
+            request = RequestFactory().get('/')
+            blocks = [('terms', self.block_terms)]
+            terms = list(TaxonomyTerm.objects.all())
+            self.assertEqual(list(send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)['terms']),
+                             terms)
+            with self.assertNumQueries(0):
+                self.assertEqual(list(send_signal_blocks(NodeView, blocks, self.node_rev_basic.node,
+                                                         request)['terms']), terms)
+            self.assertEqual(calls, ['terms'])
+            self.term.name = "Cached term"
+            self.term.save()
+            responses = send_signal_blocks(NodeView, blocks, self.node_rev_basic.node, request)
+            self.assertIn("Cached term", [term.name for term in responses['terms']])
+            self.assertEqual(calls, ['terms', 'terms'])
+        finally:
+            block_signal.disconnect(count_view)
+        with self.assertRaises(ValueError):
+            block_cache('terms', vary_on=('session',))
+
+    def test_blocks_lazy(self):
+        """ Test that blocks are computed only when used and that their usage is logged
+        :return: None
+        """
+        node = Node.objects.select_related('page_type').get(pk=self.node_rev_front.node.pk)
+        request = RequestFactory().get('/')
+        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        request.session = {}
+        request.user = AnonymousUser()
+        get_page_layout(node.page_type_id)
+        with self.assertNumQueries(0):
+            page = NodeView().construct_context(node, request)
+        self.assertIn('signal_terms', page)
+        self.assertNotIn('static_about_4', page)
+        self.assertFalse(any(usage['used'] for usage in request.ninecms_blocks.values()))
+        self.assertEqual(list(page['signal_terms']), list(TaxonomyTerm.objects.all()))
+        self.assertTrue(request.ninecms_blocks['signal_terms']['used'])
+        self.assertFalse(request.ninecms_blocks['menu_main_menu']['used'])
+        with self.assertLogs('ninecms.utils.blocks', 'DEBUG') as logs:
+            self.client.get(url_with_lang('/search/'), {'q': "about"})
+        self.assertIn("used search_results (search-results", logs.output[0])
+        # a block without value renders as a missing variable
+        empty = LazyBlock(lambda: None)
+        for template in ('[{{ content }}]', '[{% for x in content %}{{ x }}{% endfor %}]',
+                         '[{% if content %}content{% endif %}]', '[{{ content|default_if_none:"none" }}]'):
+            self.assertEqual(Template(template).render(Context({'content': empty})),
+                             Template(template).render(Context({})))
+        self.assertEqual(Template('[{{ content|default:"none" }}]').render(Context({'content': empty})), '[none]')
+        self.assertEqual((str(empty), list(empty), len(empty)), ('', [], 0))
+        self.assertEqual(Template('{% for x in content %}{{ x }}{% endfor %}').render(Context({
+            'content': LazyBlock(lambda: TaxonomyTerm.objects.filter(pk=self.term.pk))})), self.term.name)
+
     """ Contact System """
     def test_contact_form_invalid(self):
         """ Test that an empty form is invalid
@@ -446,3 +1052,95 @@ class ContentTests(TestCase):
         self.assertContains(response, '/block/1/">About 1</a>')
         response = self.client.get(reverse('ninecms:alias', args=('search/',)), {'q': 'test'})
         self.assertContains(response, '<p>No results found.</p>')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-search-pages'}},
+                       SEARCH_RESULTS_PER_PAGE=5, SEARCH_RESULTS_MAX=7, SEARCH_SNIPPET_LENGTH=60)
+    def test_search_results_pages(self):
+        """ Test that search results are capped, paginated, cached per page and rendered with snippets
+        :return: None
+        """
+        page_type = self.node_rev_basic.node.page_type
+        user = self.node_rev_basic.node.user
+        for i in range(8):
+            Node.objects.create(page_type=page_type, title="Paged %d" % i, user=user,
+                                body="<p>%s the <b>needle</b> &amp; the rest of the text</p>" % ("word " * 20))
+        self.assertEqual(snippet("<p>A needle</p>", {'needle'}), 'A <mark>needle</mark>')
+        results = search_page('needle', 'en', None)
+        self.assertEqual((results['count'], len(results['nodes']), results['page_obj'].number), (7, 5, 1))
+        self.assertTrue(results['is_paginated'])
+        self.assertTrue(results['nodes'][0]['snippet'].startswith('&hellip; word'))
+        self.assertIn('the <mark>needle</mark> &amp; the rest', results['nodes'][0]['snippet'])
+        with self.assertNumQueries(0):
+            self.assertEqual(search_page('needle', 'en', '1')['nodes'], results['nodes'])
+        self.assertEqual(len(search_page('needle', 'en', '2')['nodes']), 2)
+        self.assertEqual(search_page('needle', 'en', '9')['page_obj'].number, 2)
+        Node.objects.filter(title="Paged 0").delete()
+        self.assertNotIn("Paged 0", [item['title'] for item in search_page('needle', 'en', '1')['nodes']])
+        translation.activate(settings.LANGUAGE_CODE)
+        response = self.client.get(reverse('ninecms:alias', args=('search/',)), {'q': 'needle', 'page': 2})
+        self.assertContains(response, '<p class="snippet">', count=2)
+        self.assertContains(response, 'href="?q=needle&amp;page=1"')
+        self.assertNotContains(response, '<b>needle</b>')
+
+    @override_settings(SEARCH_BACKEND='ninecms.utils.search.TokenSearchBackend')
+    def test_search_backends(self):
+        """ Test tokenization, ranking and filters of the token search backend, and the simple fallback backend
+        :return: None
+        """
+        self.assertEqual(tokenize('<p>Καλημέρα &amp; Hello-World</p>'), ['kalimera', 'hello', 'world'])
+        page_type = self.node_rev_basic.node.page_type
+        user = self.node_rev_basic.node.user
+        in_body = Node.objects.create(page_type=page_type, title="Ranking body", user=user,
+                                      body="<p>A page about the <em>kalimera</em> greeting</p>")
+        in_title = Node.objects.create(page_type=page_type, title="Καλημέρα", user=user, body="Kalimera greeting")
+        Node.objects.create(page_type=page_type, title="Kalimera unpublished", user=user, status=False)
+        Node.objects.create(page_type=page_type, title="Kalimera greek", user=user, language='el')
+        backend = get_search_backend()
+        results = backend.search('kalimera', 'en')
+        self.assertEqual(results.count(), 2)
+        self.assertEqual(list(results), [in_title, in_body])
+        self.assertEqual(results[1:], [in_body])
+        self.assertEqual(list(backend.search('καλημέρα greeting', 'en')), [in_title, in_body])
+        self.assertEqual(list(backend.search('kalimera missing', 'en')), [])
+        self.assertEqual(list(backend.search('!!', 'en')), [])
+        in_title.body = ''
+        in_title.title = "Good morning"
+        in_title.save()
+        self.assertEqual(list(backend.search('kalimera', 'en')), [in_body])
+        with override_settings(SEARCH_BACKEND='ninecms.utils.search.SimpleSearchBackend'):
+            self.assertEqual(list(get_search_backend().search('kalim', 'en')), [in_body])
+        SearchToken.objects.all().delete()
+        out = StringIO()
+        call_command('ninecms_search_index', stdout=out)
+        self.assertIn("%d nodes indexed." % Node.objects.count(), out.getvalue())
+        self.assertEqual(list(backend.search('kalimera', 'en')), [in_body])
+
+    def test_search_database_backend(self):
+        """ Test the full text search backend of the database (FTS5 on sqlite), kept in sync on node save and delete
+        :return: None
+        """
+        backend = get_search_backend()
+        self.assertIsInstance(backend.backend, SqliteSearchBackend)
+        page_type = self.node_rev_basic.node.page_type
+        user = self.node_rev_basic.node.user
+        in_body = Node.objects.create(page_type=page_type, title="Ranking body", user=user,
+                                      body="<p>A page about the <em>kalimera</em> greeting</p>")
+        in_title = Node.objects.create(page_type=page_type, title="Καλημέρα", user=user, body="Kalimera greeting")
+        Node.objects.create(page_type=page_type, title="Kalimera unpublished", user=user, status=False)
+        Node.objects.create(page_type=page_type, title="Kalimera greek", user=user, language='el')
+        results = backend.search('Καλημέρα', 'en')
+        self.assertEqual(results.count(), 2)
+        self.assertEqual(list(results), [in_title, in_body])
+        self.assertEqual(results[1:], [in_body])
+        self.assertEqual(results[0], in_title)
+        self.assertEqual(list(backend.search('kalimera greeting', 'en')), [in_title, in_body])
+        self.assertEqual(list(backend.search('kalimera missing', 'en')), [])
+        self.assertEqual(backend.search('!!', 'en').count(), 0)
+        in_title.delete()
+        self.assertEqual(list(backend.search('kalimera', 'en')), [in_body])
+        in_body.title = "Good morning"
+        in_body.body = ''
+        in_body.save()
+        self.assertEqual(list(backend.search('kalimera', 'en')), [])
+        self.assertEqual(list(backend.search('morning', 'en')), [in_body])
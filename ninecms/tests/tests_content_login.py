@@ -27,10 +27,8 @@ from django.conf import settings
 from guardian.models import GroupObjectPermission
 from ninecms.forms import ContentNodeEditForm, ImageForm, FileForm, VideoForm, PageTypeForm
 from ninecms.tests.setup import create_front, create_basic, create_user, create_image, create_block_simple, \
-    get_front_title, assert_front, data_login, data_node, get_basic_title, create_video, create_file, data_page_type, \
-    create_terms
+    get_front_title, assert_front, data_login, data_node, get_basic_title, data_page_type, create_terms
 from ninecms.models import PageType, Node, PageLayoutElement, ContentBlock, TaxonomyTerm
-import os
 
 
 class ContentLoginTests(TestCase):
@@ -201,40 +199,6 @@ class ContentLoginTests(TestCase):
             self.assertEqual(form.is_valid(), False)
             self.assertEqual(form.cleaned_data['title'], 'test')
 
-    def test_image_delete(self):
-        """ Test that files are deleted when a media is deleted
-        :return: None
-        """
-        obj = create_image('media_delete.jpg')
-        path = obj.image.path
-        # create_path_file(path)
-        open(path, 'a').close()
-        self.assertTrue(os.path.isfile(path))
-        obj.delete()
-        self.assertFalse(os.path.isfile(path))
-
-    def test_video_delete(self):
-        """ Test that files are deleted when a media is deleted
-        :return: None
-        """
-        obj = create_video('ninecms/basic/image/media_delete.jpg')
-        path = obj.video.path
-        open(path, 'a').close()
-        self.assertTrue(os.path.isfile(path))
-        obj.delete()
-        self.assertFalse(os.path.isfile(path))
-
-    def test_file_delete(self):
-        """ Test that files are deleted when a media is deleted
-        :return: None
-        """
-        obj = create_file('ninecms/basic/image/media_delete.txt')
-        path = obj.file.path
-        open(path, 'a').close()
-        self.assertTrue(os.path.isfile(path))
-        obj.delete()
-        self.assertFalse(os.path.isfile(path))
-
     def test_admin_node_action_node_publish(self):
         """ Test admin action node publish
         :return: None
@@ -8,11 +8,13 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.auth.models import Permission, Group
 from django.core.urlresolvers import reverse
 from ninecms.tests.setup import create_front, create_basic, create_simple_user, create_image, data_node
-from ninecms.utils.perms import set_perms
+from ninecms.utils.perms import get_perms, set_perms, get_page_type_perms
 from ninecms.forms import ContentTypePermissionsForm, ContentNodeEditForm
 
 
@@ -81,6 +83,31 @@ class ContentLoginSimpleTests(TestCase):
         self.assertNotContains(response, "Clear cache")
         self.assertNotContains(response, '<option value="delete_selected">')
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-perms'}})
+    def test_page_type_perms_snapshot(self):
+        """ Test that permission snapshots are cached and invalidated on perms and group membership changes
+        :return: None
+        """
+        request = RequestFactory().get('/')
+        request.user = self.simple_user
+        basic_type_id = self.node_rev_basic.node.page_type_id
+        self.assertNotIn(basic_type_id, get_page_type_perms(request)['change'])
+        with self.assertNumQueries(0):
+            get_page_type_perms(request)
+            request = RequestFactory().get('/')
+            request.user = self.simple_user
+            get_page_type_perms(request)
+        perms = {'add_node': [self.simple_group], 'change_node': [self.simple_group], 'delete_node': []}
+        set_perms(self.node_rev_basic.node.page_type, self.fields, '_pagetype', perms)
+        request = RequestFactory().get('/')
+        request.user = self.simple_user
+        self.assertIn(basic_type_id, get_page_type_perms(request)['change'])
+        self.simple_user.groups.remove(self.simple_group)
+        request = RequestFactory().get('/')
+        request.user = self.simple_user
+        self.assertNotIn(basic_type_id, get_page_type_perms(request)['change'])
+
     def test_admin_node_change_page(self):
         """ Test that renders properly /admin/ninecms/node/<node_id>/
         Get the basic page to test image as well
@@ -171,3 +198,22 @@ class ContentLoginSimpleTests(TestCase):
         self.assertTrue(self.simple_user.has_perm('change_node_pagetype', obj))
         self.assertFalse(self.simple_user.has_perm('delete_node_pagetype', obj))
         self.assertFalse(self.simple_user.has_perm('add_node_pagetype', obj))
+
+    def test_utils_perms_bulk(self):
+        """ Test that setting perms for many groups takes as many queries as for a single group
+        :return: None
+        """
+        obj = self.node_rev_basic.node.page_type
+        groups = list(Group.objects.create(name='group-%d' % i) for i in range(10))
+        empty = {'change_node': [], 'delete_node': [], 'add_node': []}
+        set_perms(obj, self.fields, '_pagetype', empty)
+        with CaptureQueriesContext(connection) as single:
+            set_perms(obj, self.fields, '_pagetype', {field: groups[:1] for field in self.fields})
+        set_perms(obj, self.fields, '_pagetype', empty)
+        with CaptureQueriesContext(connection) as many:
+            set_perms(obj, self.fields, '_pagetype', {field: groups for field in self.fields})
+        self.assertEqual(len(many), len(single))
+        perms = {'change_node': groups[:5], 'delete_node': groups[5:], 'add_node': []}
+        set_perms(obj, self.fields, '_pagetype', perms)
+        self.assertEqual({field: set(groups) for field, groups in get_perms(obj, self.fields, '_pagetype').items()},
+                         {field: set(groups) for field, groups in perms.items()})
@@ -0,0 +1,126 @@
+"""
+Tests declaration for Nine CMS
+
+Media file deletion and cache invalidation, which are deferred until the transaction is committed
+"""
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.test import TransactionTestCase, override_settings
+from django.db import transaction
+from ninecms.models import Image
+from ninecms.tests.setup import create_image, create_video, create_file
+from ninecms.utils.media import style_path_file_name, submit
+from ninecms.utils.cache import TaggedCache, invalidate
+from unittest import mock
+import os
+
+
+class MediaDeleteTests(TransactionTestCase):
+    """ Tests for media file deletion, with transactions committed
+    Settings for tests run background tasks synchronously
+    """
+    def test_image_delete(self):
+        """ Test that files are deleted when a media is deleted
+        :return: None
+        """
+        obj = create_image('media_delete.jpg')
+        path = obj.image.path
+        # create_path_file(path)
+        open(path, 'a').close()
+        self.assertTrue(os.path.isfile(path))
+        obj.delete()
+        self.assertFalse(os.path.isfile(path))
+
+    def test_image_delete_styles(self):
+        """ Test that image style derivatives are deleted when an image is deleted
+        :return: None
+        """
+        obj = create_image('media_delete.jpg')
+        path = obj.image.path
+        open(path, 'a').close()
+        style_file = style_path_file_name(path, 'thumbnail')
+        os.makedirs(os.path.dirname(style_file), exist_ok=True)
+        open(style_file, 'a').close()
+        obj.delete()
+        self.assertFalse(os.path.isfile(path))
+        self.assertFalse(os.path.isfile(style_file))
+
+    def test_video_delete(self):
+        """ Test that files are deleted when a media is deleted
+        :return: None
+        """
+        obj = create_video('ninecms/basic/image/media_delete.jpg')
+        path = obj.video.path
+        open(path, 'a').close()
+        self.assertTrue(os.path.isfile(path))
+        obj.delete()
+        self.assertFalse(os.path.isfile(path))
+
+    def test_file_delete(self):
+        """ Test that files are deleted when a media is deleted
+        :return: None
+        """
+        obj = create_file('ninecms/basic/image/media_delete.txt')
+        path = obj.file.path
+        open(path, 'a').close()
+        self.assertTrue(os.path.isfile(path))
+        obj.delete()
+        self.assertFalse(os.path.isfile(path))
+
+    def test_image_delete_rollback(self):
+        """ Test that files are kept if the transaction that deletes a media is rolled back
+        :return: None
+        """
+        obj = create_image('media_delete.jpg')
+        path = obj.image.path
+        open(path, 'a').close()
+        try:
+            with transaction.atomic():
+                obj.delete()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertTrue(os.path.isfile(path))
+        os.remove(path)
+
+    def test_image_delete_batch(self):
+        """ Test that the files of a queryset delete are removed by a single task, except those rolled back
+        :return: None
+        """
+        paths = []
+        for name in ('media_delete_1.jpg', 'media_delete_2.jpg', 'media_delete_3.jpg'):
+            paths.append(create_image(name).image.path)
+            open(paths[-1], 'a').close()
+        with mock.patch('ninecms.utils.media.submit', wraps=submit) as submitted:
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        Image.objects.filter(image__endswith='media_delete_2.jpg').delete()
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                Image.objects.filter(image__regex=r'media_delete_[13]\.jpg$').delete()
+                self.assertTrue(all(os.path.isfile(path) for path in paths))
+        self.assertEqual(submitted.call_count, 1)
+        self.assertEqual([os.path.isfile(path) for path in paths], [False, True, False])
+        os.remove(paths[1])
+
+
+class CacheCommitTests(TransactionTestCase):
+    """ Tests for cache invalidation, with transactions committed """
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'test-invalidate-commit'}})
+    def test_invalidate_on_commit(self):
+        """ Test that entries built from the data committed before are invalidated when the transaction commits
+        :return: None
+        """
+        tagged_cache = TaggedCache('test-commit', tags=('commit',))
+        with transaction.atomic():
+            invalidate('commit')
+            # a concurrent request that rebuilds the entry before commit gets the new version
+            tagged_cache.set('key', 'stale', tagged_cache.versions())
+            self.assertEqual(tagged_cache.get('key'), 'stale')
+        self.assertIsNone(tagged_cache.get('key'))
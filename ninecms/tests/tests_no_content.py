@@ -18,9 +18,11 @@ from ninecms.models import Node
 from ninecms.tests.setup import assert_no_front, create_front, assert_front, create_basic, assert_basic, url_with_lang
 from ninecms.management.commands.check_updates import Capturing
 from ninecms.checks import check_settings
+from ninecms.utils.sanitize import sanitize
 from io import StringIO
 # noinspection PyPackageRequirements
 import pip
+import bleach
 
 
 class NoContentTests(TestCase):
@@ -109,6 +111,20 @@ class NoContentTests(TestCase):
         call_command('cache_clear', stdout=out)
         self.assertEqual(out.getvalue(), 'Cache cleared.\n')
 
+    def test_sanitize_policies(self):
+        """ Test that precompiled sanitize policies clean the same as bleach and follow the setting
+        :return: None
+        """
+        text = '<p style="color: red; float: left">Text</p><div class="x">Div</div><script>alert(1)</script>'
+        policy = settings.SANITIZE_POLICIES['basic']
+        expected = bleach.clean(text, tags=policy['tags'], attributes=policy['attributes'], styles=policy['styles'])
+        self.assertEqual(sanitize(text), expected)
+        self.assertEqual(sanitize(text), expected)
+        self.assertIn('<div class="x">Div</div>', sanitize(text, full_html=True))
+        self.assertEqual(sanitize(text, allow_html=False), 'TextDivalert(1)')
+        with self.settings(SANITIZE_POLICIES={'basic': {'tags': ['p']}}):
+            self.assertEqual(sanitize(text), bleach.clean(text, tags=['p'], attributes={}, styles=[]))
+
     def test_checks(self):
         """ Test custom system checks
         :return: None
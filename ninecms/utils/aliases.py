@@ -0,0 +1,84 @@
+""" Url alias utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, CharField
+from ninecms.models import Node
+from ninecms.signals import invalidate_nodes
+
+
+def chunks(items, size):
+    """ Split a list in consecutive chunks
+    :param items: a list
+    :param size: the maximum chunk size
+    :return: a generator of lists
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def compute_aliases(queryset):
+    """ Compute the aliases of nodes from the url pattern of their page type, as `Node.save` does for an empty alias
+    Collisions are resolved in memory, both within the batch and against the aliases of all other nodes,
+    by appending the node id, in order of node id
+    :param queryset: the Node queryset to regenerate aliases for
+    :return: a dictionary of node id: (old alias, new alias)
+    """
+    nodes = queryset.select_related('page_type').order_by('id')
+    aliases = {}
+    languages = {}
+    for node in nodes.iterator():
+        old_alias, node.alias = node.alias, ''
+        node.format_alias()
+        aliases[node.id] = (old_alias, node.alias)
+        languages[node.id] = node.language
+    taken = set()
+    for node_id, alias, language in Node.objects.exclude(alias='').values_list('id', 'alias', 'language').iterator():
+        if node_id not in aliases:
+            taken.add((alias, language))
+    for node_id in sorted(aliases):
+        old_alias, alias = aliases[node_id]
+        if not alias:
+            continue
+        while (alias, languages[node_id]) in taken:
+            alias = '%s/%d' % (alias, node_id)
+        taken.add((alias, languages[node_id]))
+        aliases[node_id] = (old_alias, alias)
+    return aliases
+
+
+def regenerate_aliases(queryset, chunk_size=None, dry_run=False, progress=None):
+    """ Regenerate the url aliases of nodes in bulk
+    All aliases are computed in memory (see `compute_aliases`) and only the changed ones are written,
+    in chunks with a single update statement each, within a single transaction
+    The changed aliases are first cleared, so that swapping aliases between nodes does not violate the unique index
+    Cached content of the updated nodes is invalidated, as updates send no signals
+    :param queryset: the Node queryset to regenerate aliases for
+    :param chunk_size: the number of nodes per update statement; default `ALIAS_REGENERATE_CHUNK_SIZE`
+    :param dry_run: only compute the aliases, do not write
+    :param progress: an optional callable that receives the number of nodes written and the total to write
+    :return: a tuple of the number of nodes processed and the number of nodes changed
+    """
+    chunk_size = chunk_size or settings.ALIAS_REGENERATE_CHUNK_SIZE
+    aliases = compute_aliases(queryset)
+    changed = sorted(node_id for node_id, (old_alias, alias) in aliases.items() if old_alias != alias)
+    if dry_run or not changed:
+        return len(aliases), len(changed)
+    with transaction.atomic():
+        for chunk in chunks(changed, chunk_size):
+            Node.objects.filter(id__in=chunk).update(alias='')
+        done = 0
+        for chunk in chunks(changed, chunk_size):
+            Node.objects.filter(id__in=chunk).update(alias=Case(
+                *(When(id=node_id, then=Value(aliases[node_id][1])) for node_id in chunk),
+                output_field=CharField()
+            ))
+            invalidate_nodes(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(changed))
+    return len(aliases), len(changed)
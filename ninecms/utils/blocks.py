@@ -0,0 +1,386 @@
+""" Block render utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import translation
+from django.utils.functional import SimpleLazyObject, empty
+from ninecms.utils.cache import TaggedCache, invalidate
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from collections import OrderedDict
+from functools import partial
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+# number of signal blocks submitted to the worker pool that have not completed yet
+_busy = 0
+
+results = TaggedCache('block', tags=('block',))
+
+# cache policy of signal block results per view name (see `block_cache`)
+_policies = {}
+
+# last result of each signal block view per user, node and language, used when a view times out
+_fallbacks = {}
+FALLBACKS_MAX = 1000
+
+
+def get_executor():
+    """ Get the signal block worker pool, create it on first use
+    Separate from the background task pool, so that long tasks do not delay page renders
+    :return: a ThreadPoolExecutor object
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BLOCK_SIGNALS_WORKERS)
+    return _executor
+
+
+def block_tag(view):
+    """ Get the cache tag of the results of a signal block view, that pages with blocks of the view also depend on
+    :param view: the signal block view name
+    :return: the tag
+    """
+    return 'block:%s' % view
+
+
+def page_tags(views):
+    """ Get the tags that a rendered page with signal blocks of the given views depends on
+    Views with a cache policy are invalidated by the models of the policy (see `block_cache`), so pages depend on
+    their view tag only; pages with any other view also depend on the 'signal' tag, that any node or term change bumps
+    :param views: an iterable of signal block view names
+    :return: a tuple of tags
+    """
+    views = list(views)
+    tags = tuple(block_tag(view) for view in views)
+    if any(view not in _policies for view in views):
+        tags = ('signal',) + tags
+    return tags
+
+
+def user_key(request):
+    """ Get the user part of result keys: the user id, or 'anonymous' for anonymous users and requests without user
+    :param request: the request object
+    :return: the user id or 'anonymous'
+    """
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated() else 'anonymous'
+
+
+def last_response(responses):
+    """ Get the response of a signal block as `construct_context` always did: the last response that is not None
+    :param responses: a list of (receiver, response) tuples as returned by `Signal.send`
+    :return: the response value or None
+    """
+    responses = [response for receiver, response in responses if response is not None]
+    return responses[-1] if responses else None
+
+
+class BlockCachePolicy(object):
+    """ The cache policy of the results of a signal block view """
+    vary_options = ('language', 'user', 'node')
+
+    def __init__(self, view, timeout, vary_on, models):
+        """ Initialize the policy
+        :param view: the signal block view name
+        :param timeout: cache timeout (seconds) of the results
+        :param vary_on: the request properties that results depend on, any of 'language', 'user', 'node'
+        :param models: models whose changes invalidate the results
+        :return: None
+        """
+        for vary in vary_on:
+            if vary not in self.vary_options:
+                raise ValueError("Invalid vary_on value '%s' for signal block view '%s'" % (vary, view))
+        self.view = view
+        self.timeout = timeout
+        self.vary_on = tuple(vary_on)
+        self.models = tuple(models)
+        self.tag = block_tag(view)
+
+    def key(self, node, request):
+        """ Get the cache key of the result for a request
+        :param node: the node rendered
+        :param request: the request object
+        :return: a key tuple
+        """
+        key = (self.view,)
+        for vary in self.vary_on:
+            if vary == 'language':
+                key += (translation.get_language(),)
+            elif vary == 'user':
+                key += (user_key(request),)
+            else:
+                key += (node.id,)
+        return key
+
+    # noinspection PyUnusedLocal
+    def invalidate(self, sender, **kwargs):
+        """ Invalidate all cached results of the view and the pages that render it, as a receiver of model signals
+        :param sender: the model changed
+        :param kwargs: other arguments
+        :return: None
+        """
+        invalidate(self.tag)
+
+
+def block_cache(view, timeout=None, vary_on=('language',), models=()):
+    """ Decorator for signal block receivers that declares how the results of a view are cached
+    Results are cached for `timeout` seconds per view and the values of `vary_on`,
+    and invalidated on save or delete of any of `models` (or change of their many to many relations)
+    On a cache hit no receiver is called; the result of all receivers of the view is cached, as rendered
+    Results are pickled, so querysets are evaluated when cached
+    Eg `@block_cache('news', timeout=300, vary_on=('language',), models=(Node,))`
+    :param view: the signal block view name
+    :param timeout: cache timeout (seconds) of the results; None for no expiry, relying on invalidation only
+    :param vary_on: the request properties that results depend on, any of 'language', 'user', 'node'
+    :param models: models whose changes invalidate the results
+    :return: the decorator
+    """
+    policy = BlockCachePolicy(view, timeout, vary_on, models)
+
+    def decorator(func):
+        _policies[view] = policy
+        for model in policy.models:
+            post_save.connect(policy.invalidate, sender=model, weak=False, dispatch_uid=(policy.tag, model, 'save'))
+            post_delete.connect(policy.invalidate, sender=model, weak=False,
+                                dispatch_uid=(policy.tag, model, 'delete'))
+            for field in model._meta.many_to_many:
+                m2m_changed.connect(policy.invalidate, sender=field.remote_field.through, weak=False,
+                                    dispatch_uid=(policy.tag, model, field.name))
+        return func
+    return decorator
+
+
+def send_signal_blocks(sender, blocks, node, request):
+    """ Get the responses of all signal blocks of a page
+    Results of views with a cache policy (see `block_cache`) are served from cache; receivers are called on a miss only
+    If `BLOCK_SIGNALS_PARALLEL` is set, the signal of each block is sent in the worker pool, so that the page waits
+    for the slowest block instead of all of them in turn (see `send_parallel`); otherwise signals are sent in order
+    :param sender: the sender class
+    :param blocks: a list of (region key, block) tuples of signal blocks
+    :param node: the node rendered
+    :param request: the request object
+    :return: a dictionary of region key: response value
+    """
+    # imported here, as the signals module declares its block cache policies with `block_cache`
+    from ninecms.signals import block_signal
+    responses = {}
+    misses = []
+    for reg, block in blocks:
+        policy = _policies.get(block.signal)
+        if policy is not None:
+            key = policy.key(node, request)
+            cached = results.get(key)
+            if cached is not None:
+                responses[reg] = cached[0]
+                continue
+            misses.append((reg, block, key, results.versions((policy.tag,))))
+        else:
+            misses.append((reg, block, None, None))
+    if not settings.BLOCK_SIGNALS_PARALLEL or not misses:
+        for reg, block, key, versions in misses:
+            responses[reg] = last_response(block_signal.send(sender=sender, view=block.signal, node=node,
+                                                             request=request))
+    else:
+        responses.update(send_parallel(sender, [(reg, block) for reg, block, key, versions in misses], node, request))
+    if not getattr(request, 'ninecms_blocks_timed_out', False):
+        for reg, block, key, versions in misses:
+            if key is not None:
+                results.set(key, (responses[reg],), versions, _policies[block.signal].timeout)
+    return responses
+
+
+def send_parallel(sender, blocks, node, request):
+    """ Send the signals of signal blocks concurrently, each in the worker pool
+    Each block is given `BLOCK_SIGNALS_TIMEOUT` seconds from submission; on timeout its last result for the same
+    view, user, node and language is used instead, if any, and the request is marked with `ninecms_blocks_timed_out`
+    so that the page is not cached; a block that times out updates the last result when it completes
+    A running receiver cannot be stopped, so a receiver that hangs keeps its worker busy; while all workers are busy,
+    blocks are not queued: their last result is used if any, otherwise their signal is sent in the request thread
+    Signals run on their own database connections, outside of the request transaction, in the request language
+    Exceptions of receivers are raised as with `Signal.send`
+    :param sender: the sender class
+    :param blocks: a list of (region key, block) tuples of signal blocks
+    :param node: the node rendered
+    :param request: the request object
+    :return: a dictionary of region key: response value
+    """
+    from ninecms.signals import block_signal
+    global _busy
+    executor = get_executor()
+    language = translation.get_language()
+    user = user_key(request)
+    responses = {}
+    calls = []
+    for reg, block in blocks:
+        key = (block.signal, user, node.id, language)
+        with _lock:
+            full = _busy >= settings.BLOCK_SIGNALS_WORKERS
+            if not full:
+                _busy += 1
+        if full:
+            responses[reg] = _fallbacks.get(key)
+            if responses[reg] is None:
+                responses[reg] = last_response(block_signal.send(sender=sender, view=block.signal, node=node,
+                                                                 request=request))
+            else:
+                request.ninecms_blocks_timed_out = True
+                logger.warning("Signal block '%s' not sent, all workers are busy; using last result", key[0])
+            continue
+        future = executor.submit(receive, block_signal, sender, block.signal, node, request, language)
+        future.add_done_callback(partial(store_fallback, key))
+        calls.append((reg, key, future, time.time() + settings.BLOCK_SIGNALS_TIMEOUT))
+    for reg, key, future, deadline in calls:
+        try:
+            responses[reg] = future.result(timeout=max(0, deadline - time.time()))
+        except TimeoutError:
+            future.cancel()
+            responses[reg] = _fallbacks.get(key)
+            request.ninecms_blocks_timed_out = True
+            logger.warning("Signal block '%s' timed out, %s", key[0],
+                           "using last result" if responses[reg] is not None else "no result available")
+    return responses
+
+
+def receive(signal, sender, view, node, request, language):
+    """ Send the signal of a signal block in a worker thread
+    The database connections of the thread are closed afterwards, as the thread is not managed by a request
+    :param signal: the block signal
+    :param sender: the sender class
+    :param view: the signal block view name
+    :param node: the node rendered
+    :param request: the request object
+    :param language: the language to activate
+    :return: the block response, as `last_response`
+    """
+    try:
+        with translation.override(language):
+            return last_response(signal.send(sender=sender, view=view, node=node, request=request))
+    finally:
+        connections.close_all()
+
+
+def store_fallback(key, future):
+    """ Keep the result of a completed signal block as fallback for later timeouts, and release its worker
+    :param key: the fallback key of view, user, node id and language
+    :param future: the completed Future object
+    :return: None
+    """
+    global _busy
+    with _lock:
+        _busy -= 1
+    if future.cancelled() or future.exception() is not None:
+        return
+    with _lock:
+        if len(_fallbacks) >= FALLBACKS_MAX and key not in _fallbacks:
+            _fallbacks.clear()
+        _fallbacks[key] = future.result()
+
+
+class LazyBlock(SimpleLazyObject):
+    """ The context value of a block, computed on first access, eg when a template renders or tests it
+    Proxies the value as `SimpleLazyObject` does, except that a None value behaves as a missing variable,
+    as blocks without value used to be left out of the context: it renders as an empty string, is false and is empty
+    """
+    def _value(self):
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+    def __str__(self):
+        return '' if self._value() is None else str(self._wrapped)
+
+    def __iter__(self):
+        return iter(()) if self._value() is None else iter(self._wrapped)
+
+    def __len__(self):
+        return 0 if self._value() is None else len(self._wrapped)
+
+
+def lazy_block(request, reg, block_type, func):
+    """ Wrap the construction of a block value in a lazy object that records its usage in the request
+    The usage of all blocks of the request is kept in `request.ninecms_blocks` (see `log_blocks`)
+    :param request: the request object
+    :param reg: the region key of the block
+    :param block_type: the block type
+    :param func: a callable that returns the block value
+    :return: a LazyBlock object
+    """
+    if not hasattr(request, 'ninecms_blocks'):
+        request.ninecms_blocks = OrderedDict()
+    request.ninecms_blocks[reg] = {'type': block_type, 'used': False, 'time': None}
+    return LazyBlock(partial(evaluate_block, request.ninecms_blocks[reg], func))
+
+
+def evaluate_block(usage, func):
+    """ Compute a block value and record that it has been used, along with the time it took
+    :param usage: the usage dictionary of the block
+    :param func: a callable that returns the block value
+    :return: the block value
+    """
+    start = time.time()
+    value = func()
+    usage['used'] = True
+    usage['time'] = time.time() - start
+    return value
+
+
+def log_blocks(request, node):
+    """ Log which blocks of a page have been used by the template and the time each took to compute
+    Logged with debug level, to be enabled in the logging configuration of `ninecms.utils.blocks`
+    :param request: the request object
+    :param node: the node rendered
+    :return: None
+    """
+    blocks = getattr(request, 'ninecms_blocks', None)
+    if not blocks or not logger.isEnabledFor(logging.DEBUG):
+        return
+    used = ['%s (%s, %.1f ms)' % (reg, usage['type'], usage['time'] * 1000)
+            for reg, usage in blocks.items() if usage['used']]
+    unused = ['%s (%s)' % (reg, usage['type']) for reg, usage in blocks.items() if not usage['used']]
+    logger.debug("Blocks of %s, page type %s: used %s; unused %s", request.path, node.page_type.name,
+                 ', '.join(used) or '-', ', '.join(unused) or '-')
+
+
+class LazySignalBlocks(object):
+    """ The responses of the signal blocks of a page, sent on first access
+    If `BLOCK_SIGNALS_PARALLEL` is set, all signal blocks that have not been sent yet are sent together,
+    so that they run concurrently; otherwise each block is sent when accessed
+    """
+    def __init__(self, sender, blocks, node, request):
+        """ Initialize the responses
+        :param sender: the sender class
+        :param blocks: a list of (region key, block) tuples of signal blocks
+        :param node: the node rendered
+        :param request: the request object
+        :return: None
+        """
+        self.sender = sender
+        self.blocks = blocks
+        self.node = node
+        self.request = request
+        self.responses = {}
+
+    def get(self, reg):
+        """ Get the response of a signal block, sending the signal if not sent yet
+        :param reg: the region key of the block
+        :return: the response value
+        """
+        if reg not in self.responses:
+            if settings.BLOCK_SIGNALS_PARALLEL:
+                blocks = [(key, block) for key, block in self.blocks if key not in self.responses]
+            else:
+                blocks = [(key, block) for key, block in self.blocks if key == reg]
+            self.responses.update(send_signal_blocks(self.sender, blocks, self.node, self.request))
+        return self.responses[reg]
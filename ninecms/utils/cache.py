@@ -0,0 +1,196 @@
+""" Cache utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.core.cache import cache, caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.db import transaction
+from functools import partial
+from uuid import uuid4
+import hashlib
+
+# process-local mirror of tag versions, used when the cache backend does not keep anything (dummy)
+_versions = {}
+
+# all namespaces with process-local entries
+_local_caches = []
+
+
+def tag_key(tag):
+    """ Get the cache key that holds the version of a tag
+    :param tag: the tag name, eg 'layout' or 'node:12'
+    :return: the cache key
+    """
+    return 'ninecms:tag:%s' % tag
+
+
+def get_versions(tags):
+    """ Get the current version of each tag
+    A tag that has never been set (or has been evicted) gets a new version,
+    so that entries that were stored with an older one are not considered valid, in any process
+    Only if the cache backend keeps nothing (dummy) the process-local version is used instead,
+    so that process-local entries remain valid until invalidated in this process
+    :param tags: an iterable of tag names
+    :return: a dictionary of tag: version
+    """
+    keys = dict((tag, tag_key(tag)) for tag in tags)
+    if not keys:
+        return {}
+    stored = cache.get_many(keys.values())
+    versions = {}
+    missing = {}
+    for tag, key in keys.items():
+        if key in stored:
+            versions[tag] = stored[key]
+        else:
+            if isinstance(caches[DEFAULT_CACHE_ALIAS], DummyCache):
+                versions[tag] = _versions.setdefault(tag, uuid4().hex)
+            else:
+                versions[tag] = uuid4().hex
+            missing[key] = versions[tag]
+        _versions[tag] = versions[tag]
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+def clear_local():
+    """ Clear all process-local tag versions and entries, eg after the cache has been cleared
+    :return: None
+    """
+    _versions.clear()
+    for tagged_cache in _local_caches:
+        tagged_cache.local.clear()
+
+
+def invalidate(*tags):
+    """ Invalidate all cache entries that depend on any of the tags given
+    Tags are invalidated immediately and, inside a transaction of the default database, again when it is committed,
+    so that entries built meanwhile by other requests from the data committed before are not valid either
+    :param tags: tag names
+    :return: None
+    """
+    bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(bump, tags))
+
+
+def bump(tags):
+    """ Set a new version for each tag
+    :param tags: tag names
+    :return: None
+    """
+    versions = dict((tag, uuid4().hex) for tag in tags)
+    _versions.update(versions)
+    cache.set_many(dict((tag_key(tag), version) for tag, version in versions.items()), None)
+
+
+class TaggedCache(object):
+    """ A cache namespace whose entries are invalidated by tags
+    Each entry is stored along with the versions of the tags it depends on at the time it was built
+    An entry is valid as long as none of these tags has been invalidated since
+    If `local` is set, entries are also kept in a process-local dictionary, so that a hit costs a single cache call
+    (to check the tag versions) without unpickling the value
+    """
+    def __init__(self, name, tags=(), timeout=DEFAULT_TIMEOUT, local=False, max_entries=1000):
+        """ Initialize the namespace
+        :param name: the namespace name, used as key prefix
+        :param tags: tags that all entries of the namespace depend on
+        :param timeout: default timeout for entries
+        :param local: also keep entries in a process-local dictionary
+        :param max_entries: the maximum number of local entries to keep before culling
+        :return: None
+        """
+        self.name = name
+        self.tags = tuple(tags)
+        self.timeout = timeout
+        self.local = {} if local else None
+        self.max_entries = max_entries
+        if local:
+            _local_caches.append(self)
+
+    def make_key(self, key):
+        """ Construct a cache key; the key is hashed so that any alias or user input is a valid memcached key
+        :param key: a key string or a tuple of key parts
+        :return: the cache key
+        """
+        if not isinstance(key, (tuple, list)):
+            key = (key,)
+        digest = hashlib.md5(':'.join(str(part) for part in key).encode()).hexdigest()
+        return 'ninecms:%s:%s' % (self.name, digest)
+
+    def versions(self, tags=()):
+        """ Get the tag versions to store an entry with
+        Should be called before building the value, so that an invalidation during build is not missed
+        :param tags: additional tags for the entry
+        :return: a dictionary of tag: version
+        """
+        return get_versions(self.tags + tuple(tags))
+
+    def get(self, key, default=None):
+        """ Get a valid entry from the cache
+        :param key: the entry key
+        :param default: value to return if there is no valid entry
+        :return: the cached value or default
+        """
+        cache_key = self.make_key(key)
+        entry = self.local.get(cache_key) if self.local is not None else None
+        if entry is None:
+            entry = cache.get(cache_key)
+            if entry is None:
+                return default
+        versions, value = entry
+        if get_versions(versions.keys()) != versions:
+            return default
+        if self.local is not None:
+            self._set_local(cache_key, entry)
+        return value
+
+    def set(self, key, value, versions, timeout=DEFAULT_TIMEOUT):
+        """ Store an entry
+        :param key: the entry key
+        :param value: the value to store
+        :param versions: the tag versions as obtained by `versions()` before the value was built
+        :param timeout: entry timeout, defaults to the namespace timeout
+        :return: None
+        """
+        cache_key = self.make_key(key)
+        entry = (versions, value)
+        cache.set(cache_key, entry, self.timeout if timeout is DEFAULT_TIMEOUT else timeout)
+        if self.local is not None:
+            self._set_local(cache_key, entry)
+
+    def get_or_set(self, key, builder, tags=()):
+        """ Get a valid entry from the cache or build and store it
+        :param key: the entry key
+        :param builder: a callable that returns the value
+        :param tags: additional tags for the entry
+        :return: the value
+        """
+        value = self.get(key)
+        if value is None:
+            versions = self.versions(tags)
+            value = builder()
+            self.set(key, value, versions)
+        return value
+
+    def clear(self):
+        """ Invalidate all entries of the namespace
+        :return: None
+        """
+        invalidate(*self.tags)
+        if self.local is not None:
+            self.local.clear()
+
+    def _set_local(self, cache_key, entry):
+        """ Store an entry in the process-local dictionary, culling it if full
+        :param cache_key: the cache key
+        :param entry: the entry tuple of versions, value
+        :return: None
+        """
+        if len(self.local) >= self.max_entries and cache_key not in self.local:
+            self.local.clear()
+        self.local[cache_key] = entry
@@ -0,0 +1,41 @@
+""" Template fragment utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.translation import get_language
+from ninecms.utils.cache import TaggedCache
+from ninecms.utils.media import placeholders
+
+fragments = TaggedCache('fragment', tags=('fragment',))
+
+
+def render_static(node, classes=''):
+    """ Render the content of a static block, along with its images and videos
+    The rendered fragment is cached per node, node change time, language and classes,
+    so that pages that share a static block (eg footer or sidebar) perform no media queries or image style lookups
+    Images and videos are fetched once, when the fragment is built; media changes invalidate the node tag (see signals)
+    A fragment with an image style that is not generated yet is not cached, so that the derivative is used once ready
+    :param node: the node to render; may be None, eg for a block of another language
+    :param classes: additional classes for the block
+    :return: the rendered html
+    """
+    if not node or node.pk is None:
+        return render_to_string('ninecms/block_static_content.html', {'node': node, 'classes': classes})
+    key = (node.pk, node.changed.isoformat() if node.changed else '', get_language(), classes)
+    html = fragments.get(key)
+    if html is None:
+        versions = fragments.versions(('node:%d' % node.pk,))
+        count = placeholders()
+        html = render_to_string('ninecms/block_static_content.html', {
+            'node': node,
+            'classes': classes,
+            'images': list(node.image_set.all()),
+            'videos': list(node.video_set.all()),
+        })
+        if placeholders() == count:
+            fragments.set(key, html, versions, settings.STATIC_BLOCK_CACHE_TIMEOUT)
+    return html
@@ -0,0 +1,252 @@
+""" Image style backends
+
+Available styles
+ - thumbnail: create a thumbnail restricted to the smaller dimension
+ - thumbnail-upscale: create a thumbnail that is upscaled if smaller
+ - thumbnail-crop: create a thumbnail that is cropped to the exact dimension
+"""
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from subprocess import check_output, call, CalledProcessError
+# noinspection PyPackageRequirements
+from PIL import Image as PilImage
+from uuid import uuid4
+import shutil
+import os
+
+_backends = {}
+
+
+def get_backend():
+    """ Get the image style backend specified in `IMAGE_STYLES_BACKEND`
+    :return: an image backend object
+    """
+    path = settings.IMAGE_STYLES_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+class ImageBackend(object):
+    """ Base class for image style backends """
+    def available(self):  # pragma: nocover
+        """ Check if the backend can be used
+        :return: boolean
+        """
+        raise NotImplementedError
+
+    def generate(self, source, target, style):  # pragma: nocover
+        """ Generate an image style derivative
+        :param source: the absolute path file name of the original image
+        :param target: the absolute path file name of the derivative
+        :param style: the style dict with `type` and `size`
+        :return: True if the derivative has been generated
+        """
+        raise NotImplementedError
+
+    def make_dirs(self, target):
+        """ Create the style directory of a derivative if not exists
+        :param target: the absolute path file name of the derivative
+        :return: None
+        """
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    def temp_path(self, target):
+        """ Get a temporary path file name for a derivative, in the same directory and with the same extension,
+        so that the derivative is written there and then moved in place atomically (see `publish`)
+        :param target: the absolute path file name of the derivative
+        :return: the temporary absolute path file name
+        """
+        path, name = os.path.split(target)
+        base, ext = os.path.splitext(name)
+        return os.path.join(path, '.%s.%s%s' % (base, uuid4().hex, ext))
+
+    def publish(self, temp, target):
+        """ Move a generated derivative in place, so that requests never serve a partially written file
+        :param temp: the temporary absolute path file name, as returned by `temp_path`
+        :param target: the absolute path file name of the derivative
+        :return: True if the derivative has been published
+        """
+        try:
+            os.replace(temp, target)
+        except OSError:  # pragma: nocover
+            self.discard(temp)
+            return False
+        return True
+
+    def discard(self, temp):
+        """ Remove a temporary derivative, eg if generation failed
+        :param temp: the temporary absolute path file name
+        :return: None
+        """
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+
+class ImageMagickBackend(ImageBackend):
+    """ Generate image styles with the Imagemagick command line utilities
+    See 9cms-crop.odt
+    """
+    def available(self):
+        """ Check that imagemagick utilities are available
+        :return: boolean
+        """
+        return bool(shutil.which('identify') and shutil.which('convert'))
+
+    def generate(self, source, target, style):
+        """ Generate an image style derivative using `identify` and `convert`
+        :param source: the absolute path file name of the original image
+        :param target: the absolute path file name of the derivative
+        :param style: the style dict with `type` and `size`
+        :return: True if the derivative has been generated
+        """
+        if style['type'] not in ('thumbnail', 'thumbnail-upscale', 'thumbnail-crop'):
+            return False
+        by = chr(120)   # x
+        plus = chr(43)  # +
+
+        # remove original path file name as it may contain spaces, before splitting
+        # exception: usually file not exists (db or memcached inconsistency) or imagemagick not installed
+        try:
+            # noinspection PyUnresolvedReferences
+            source_size_str = check_output(['identify', source]).decode()
+        except (CalledProcessError, OSError):  # pragma: nocover
+            return False
+        source_size_str = source_size_str[len(source):].split(' ')[2]
+        self.make_dirs(target)
+
+        source_size_array = source_size_str.split(by)
+        source_size_x = int(source_size_array[0])
+        source_size_y = int(source_size_array[1])
+        target_size_x = style['size'][0]
+        target_size_y = style['size'][1]
+        target_size_str = str(target_size_x) + by + str(target_size_y)
+
+        # derivatives are generated in a temporary file and published when complete
+        temp = self.temp_path(target)
+        # thumbnail
+        if style['type'] == 'thumbnail':
+            if target_size_x > source_size_x and target_size_y > source_size_y:
+                target_size_str = source_size_str
+            status = call(['convert', source, '-thumbnail', target_size_str, '-antialias', temp])
+
+        # thumbnail-upscale
+        elif style['type'] == 'thumbnail-upscale':
+            status = call(['convert', source, '-thumbnail', target_size_str, '-antialias', temp])
+
+        # thumbnail-crop
+        else:
+            source_ratio = float(source_size_x) / float(source_size_y)
+            target_ratio = float(target_size_x) / float(target_size_y)
+            if source_ratio > target_ratio:  # crop vertically
+                crop_target_size_x = source_size_y * target_ratio
+                crop_target_size_y = source_size_y
+                offset = (source_size_x - crop_target_size_x) / 2
+                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + str(offset) + plus + '0'
+            else:  # crop horizontally
+                crop_target_size_x = source_size_x
+                crop_target_size_y = source_size_x / target_ratio
+                offset = (source_size_y - crop_target_size_y) / 2
+                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + '0' + plus + str(offset)
+            # the uncropped intermediate is only ever written to the temporary file
+            status = call(['convert', source, '-crop', crop_size_str, temp]) or \
+                call(['convert', temp, '-thumbnail', target_size_str, '-antialias', temp])
+            # moderators ^ and \> for -thumbnail and -resize do not work consistently:
+            # "invalid argument for option `-resize'"
+            # call(['convert', path_file_name, '-thumbnail', target_size_str + '^', '-gravity', 'center', '-extent',
+            #      target_size_str, '-antialias', style_path_file_name])
+
+        # # crop
+        # elif style['type'] == 'crop':
+        #    call(['convert', img_path_file_name, '-gravity', 'center', '-crop', target_size_str, style_path_file_name])
+        #     call(['convert', img_path_file_name, '-gravity', 'center', '-background', 'None', '-extent',
+        #           target_size_str, style_path_file_name])
+        if status != 0:  # pragma: nocover
+            self.discard(temp)
+            return False
+        return self.publish(temp, target)
+
+
+class PillowBackend(ImageBackend):
+    """ Generate image styles in process with Pillow
+    The original is decoded once; JPEG images are decoded in draft mode directly to a reduced scale,
+    and crop and thumbnail are performed in memory in a single resize
+    """
+    def available(self):
+        """ Pillow is a requirement of Django image fields
+        :return: boolean
+        """
+        return True
+
+    def target_box(self, source_size, style):
+        """ Calculate the source area to use and the size of the derivative
+        :param source_size: the (x, y) size of the original image
+        :param style: the style dict with `type` and `size`
+        :return: a tuple of the crop box (left, upper, right, lower) and the target size (x, y); None if unknown type
+        """
+        source_x, source_y = source_size
+        target_x, target_y = style['size']
+        box = (0, 0, source_x, source_y)
+        if style['type'] in ('thumbnail', 'thumbnail-upscale'):
+            ratio = min(float(target_x) / source_x, float(target_y) / source_y)
+            if style['type'] == 'thumbnail' and ratio > 1:
+                ratio = 1
+            return box, (max(1, int(round(source_x * ratio))), max(1, int(round(source_y * ratio))))
+        elif style['type'] == 'thumbnail-crop':
+            target_ratio = float(target_x) / target_y
+            if float(source_x) / source_y > target_ratio:  # crop vertically
+                crop_x = source_y * target_ratio
+                offset = (source_x - crop_x) / 2
+                box = (offset, 0, offset + crop_x, source_y)
+            else:  # crop horizontally
+                crop_y = source_x / target_ratio
+                offset = (source_y - crop_y) / 2
+                box = (0, offset, source_x, offset + crop_y)
+            return tuple(int(round(c)) for c in box), (target_x, target_y)
+        return None
+
+    def generate(self, source, target, style):
+        """ Generate an image style derivative
+        :param source: the absolute path file name of the original image
+        :param target: the absolute path file name of the derivative
+        :param style: the style dict with `type` and `size`
+        :return: True if the derivative has been generated
+        """
+        try:
+            img = PilImage.open(source)
+        except (IOError, OSError):  # pragma: nocover
+            return False
+        with img:
+            image_format = img.format
+            result = self.target_box(img.size, style)
+            if result is None:
+                return False
+            box, size = result
+            # let the jpeg decoder reduce the image while decoding, keeping at least the target resolution of the box
+            scale_x = float(box[2] - box[0]) / size[0]
+            scale_y = float(box[3] - box[1]) / size[1]
+            original_x = img.size[0]
+            img.draft(img.mode, (int(img.size[0] / scale_x), int(img.size[1] / scale_y)))
+            reduce = float(original_x) / img.size[0]
+            box = tuple(int(round(c / reduce)) for c in box)
+            if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+            derivative = img.crop(box).resize(size, PilImage.LANCZOS)
+            if image_format == 'JPEG' and derivative.mode != 'RGB':
+                derivative = derivative.convert('RGB')
+            self.make_dirs(target)
+            # the derivative is saved in a temporary file and published when complete
+            temp = self.temp_path(target)
+            try:
+                derivative.save(temp, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+            except (IOError, OSError):  # pragma: nocover
+                self.discard(temp)
+                return False
+        return self.publish(temp, target)
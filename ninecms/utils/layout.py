@@ -0,0 +1,44 @@
+""" Page layout utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.utils.text import slugify
+from ninecms.models import ContentBlock
+from ninecms.utils.cache import TaggedCache
+
+layouts = TaggedCache('layout', tags=('layout',), timeout=None, local=True)
+
+
+def region_key(name):
+    """ Get the context key of a block from its name
+    :param name: the block name
+    :return: a key that can be used in templates, eg 'menu_main' for 'menu-main'
+    """
+    return slugify(name).replace('-', '_')
+
+
+class PageLayout(object):
+    """ A compiled page layout: all blocks of a page type along with their region keys
+    Static nodes and menu items of the blocks are fetched along with the blocks in a single query
+    """
+    def __init__(self, page_type_id):
+        """ Compile the layout of a page type
+        :param page_type_id: the page type id
+        :return: None
+        """
+        self.page_type_id = page_type_id
+        self.blocks = []
+        for block in ContentBlock.objects.filter(page_types=page_type_id).select_related('node', 'menu_item'):
+            self.blocks.append((region_key(block.name), block))
+
+
+def get_page_layout(page_type_id):
+    """ Get the compiled layout of a page type
+    Layouts are cached both in process and in the django cache,
+    and invalidated on any change of content blocks, page types, nodes or menu items (see signals)
+    :param page_type_id: the page type id
+    :return: a PageLayout object
+    """
+    return layouts.get_or_set(page_type_id, lambda: PageLayout(page_type_id))
@@ -6,10 +6,29 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.db import transaction
 from ninecms.utils.transliterate import transliterate
-from subprocess import check_output, call, CalledProcessError
+from ninecms.utils.tasks import submit
+from ninecms.utils.cache import TaggedCache, invalidate
+from ninecms.utils.imaging import get_backend, PillowBackend
+# noinspection PyPackageRequirements
+from PIL import Image as PilImage
+from functools import partial
+import threading
+import json
+import time
 import os
 
+# memo of existing image style urls: image name: {style: url}, shared by all processes through the tag versions
+# of each image (see `forget_image_styles`), with a process-local copy of the entries
+style_urls = TaggedCache('style', tags=('style',), local=True, max_entries=settings.IMAGE_STYLES_MEMO_SIZE)
+
+# number of placeholder urls returned by `image_style` per thread (see `placeholders`)
+_placeholders = threading.local()
+
+# memo of the styles recorded in the image styles manifest, along with the manifest modification time
+_manifest_styles = {'mtime': None, 'styles': frozenset()}
+
 
 def path_file_name(instance, context, filename):
     """ Get path file name
@@ -81,125 +100,274 @@ def validate_video_ext(value):
     validate_ext(value, ['.mp4', '.mpeg', '.m4v', '.webm', '.ogg', '.ogv', '.flv', '.jpg'])
 
 
-def find_all(filename):
-    """ Get all path file names under the path of a given path file name
-    Useful in order to get all files and files from image styles
+def find_all(filename, styles=None):
+    """ Get the path file names of a media file and all of its image style derivatives that exist
+    Derivative paths are computed directly from the image styles, so that no directory is scanned
     Used in media delete signal
-    http://stackoverflow.com/questions/1724693/find-a-file-in-python
     :param filename: the absolute path file name to use
+    :param styles: an iterable of image style names, default is `recorded_styles()`
     :return: a list of all absolute path file names
     """
-    path = os.path.dirname(filename)
-    name = os.path.basename(filename)
-    result = []
-    for root, dirs, files in os.walk(path):
-        if name in files:
-            result.append(os.path.join(root, name))
-    return result
+    if styles is None:
+        styles = recorded_styles()
+    candidates = [filename] + [style_path_file_name(filename, style) for style in styles]
+    return [candidate for candidate in candidates if os.path.isfile(candidate)]
 
 
-def delete_all(filename):
+def delete_all(filename, styles=None):
     """ Delete all files that `find_all` returns
     :param filename: the absolute path file name to use
+    :param styles: an iterable of image style names, default is `recorded_styles()`
     :return: None
     """
-    for file in find_all(filename):
-        os.remove(file)
+    for file in find_all(filename, styles):
+        try:
+            os.remove(file)
+        except FileNotFoundError:  # pragma: nocover
+            pass
+
+
+def delete_files(files):
+    """ Delete media files along with their image style derivatives, as `delete_all` does for each
+    The recorded styles are read once for all files
+    :param files: a list of (absolute path file name, image style names) tuples; styles None for `recorded_styles()`
+    :return: None
+    """
+    recorded = None
+    for filename, styles in files:
+        if styles is None:
+            if recorded is None:
+                recorded = recorded_styles()
+            styles = recorded
+        delete_all(filename, styles)
+
+
+def delete_on_commit(filename, styles=None, using=None):
+    """ Delete a media file and its image style derivatives in the background, once the transaction is committed
+    Files deleted in the same transaction and savepoint, eg by a queryset delete, are collected in a single batch,
+    that is deleted by a single background task (see `delete_files`); files are kept if the deletion is rolled back
+    A batch is current as long as its commit hook is pending: Django replaces the list of commit hooks of a connection
+    on commit and on rollback, so a rolled back batch is never extended
+    :param filename: the absolute path file name
+    :param styles: an iterable of image style names, default is `recorded_styles()` when deleted
+    :param using: the database alias
+    :return: the list of files of the batch
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        submit(delete_files, [(filename, styles)])
+        return [(filename, styles)]
+    batch = getattr(connection, 'ninecms_media_batch', None)
+    savepoints = tuple(connection.savepoint_ids)
+    if batch is None or batch['hooks'] is not connection.run_on_commit or batch['savepoints'] != savepoints:
+        batch = {'files': [], 'savepoints': savepoints}
+        connection.ninecms_media_batch = batch
+        transaction.on_commit(partial(submit, delete_files, batch['files']), using=using)
+        batch['hooks'] = connection.run_on_commit
+    batch['files'].append((filename, styles))
+    return batch['files']
+
+
+def recorded_styles():
+    """ Get all image styles that derivatives may exist for
+    These are the styles currently defined and any other recorded in the manifest, eg styles removed since
+    The manifest is read again only if it has been modified
+    :return: a set of image style names
+    """
+    try:
+        mtime = os.path.getmtime(manifest_path_file_name())
+    except OSError:
+        mtime = None
+    if _manifest_styles.get('mtime') != mtime:
+        _manifest_styles['styles'] = frozenset(load_manifest()) if mtime is not None else frozenset()
+        _manifest_styles['mtime'] = mtime
+    return set(settings.IMAGE_STYLES) | _manifest_styles['styles']
+
+
+def style_path_file_name(path_file_name, style):
+    """ Get the path file name of an image style derivative
+    :param path_file_name: the absolute path file name of the original image, eg ~/media/ninecms/basic/image/test.png
+    :param style: the image style name
+    :return: the style path file name, eg ~/media/ninecms/basic/image/large/test.png
+    """
+    return os.path.join(os.path.dirname(path_file_name), style, os.path.basename(path_file_name))
+
+
+def style_url(url, style):
+    """ Get the url of an image style derivative
+    :param url: the url of the original image, eg /media/ninecms/basic/image/test.png
+    :param style: the image style name
+    :return: the style url, eg /media/ninecms/basic/image/large/test.png
+    """
+    url_path, file_name = url.rsplit('/', 1)
+    return '/'.join((url_path, style, file_name))
 
 
 def image_style(image, style):
     """ Return the url of different image style
-    Construct appropriately if not exist
-    See 9cms-crop.odt
-
-    Available styles
-     - thumbnail: create a thumbnail restricted to the smaller dimension
-     - thumbnail-upscale: create a thumbnail that is upscaled if smaller
-     - thumbnail-crop: create a thumbnail that is cropped to the exact dimension
+    Derivatives are generated at upload time by the background workers (see signals)
+    If a derivative does not exist yet, its generation is queued and the original url is returned as placeholder,
+    so that no process is forked during rendering; renders with a placeholder are not cached (see `placeholders`)
+    Existing derivatives are memoized in the cache, so that warm renders perform no filesystem access
 
     :param image: ImageFieldFile
     :param style: Specify style to return image
-    :return: image url of specified style
+    :return: image url of specified style, or the original image url if not yet generated
     """
     if not image:  # pragma: nocover
         return image
-    # original url full: /media/ninecms/basic/image/test.png
-    url = image.url
-    # original url without file: /media/ninecms/basic/image
-    url_path = '/'.join(url.split('/')[:-1])
-    # original path full: ~/ninecms/media/ninecms/basic/image/test.png
-    img_path_file_name = str(image.file)
-    # original file: test.png
-    img_file_name = os.path.basename(img_path_file_name)
-
-    # style url without file: /media/ninecms/basic/image/large
-    style_url_path = '/'.join((url_path, style))
-    # style url full: /media/ninecms/basic/image/large/test.png
-    style_url = '/'.join((style_url_path, img_file_name))
-    # style path without file: ~/ninecms/media/ninecms/basic/image/large
-    style_path = os.path.join(os.path.dirname(img_path_file_name), style)
-    # style path full: ~/ninecms/media/ninecms/basic/image/large/test.png
-    style_path_file_name = os.path.join(style_path, img_file_name)
+    styles = style_urls.get(image.name, {})
+    if style in styles:
+        return styles[style]
+    versions = style_urls.versions(('image:%s' % image.name,))
+    if os.path.exists(style_path_file_name(image.path, style)):
+        url = style_url(image.url, style)
+        style_urls.set(image.name, dict(styles, **{style: url}), versions)
+        return url
+    submit(generate_style, image.path, style, key=(image.path, style))
+    _placeholders.count = placeholders() + 1
+    return image.url
+
+
+def placeholders():
+    """ Get the number of placeholder urls that `image_style` has returned in the current thread
+    Compare the number before and after a render to tell whether the output includes any, so that it is not cached
+    :return: the number of placeholders returned
+    """
+    return getattr(_placeholders, 'count', 0)
 
-    # the style dict
-    style_def = settings.IMAGE_STYLES[style]
 
-    if not os.path.exists(style_path_file_name):
-        if not os.path.exists(style_path):
-            os.makedirs(style_path)
-        by = chr(120)   # x
-        plus = chr(43)  # +
+def forget_image_styles(name=None):
+    """ Remove the memoized style urls of an image, eg on upload or delete, in all processes
+    :param name: the image name (relative to media root); if None forget all images
+    :return: None
+    """
+    if name is None:
+        style_urls.clear()
+    else:
+        invalidate('image:%s' % name)
 
-        # remove original path file name as it may contain spaces, before splitting
-        # exception: usually file not exists (db or memcached inconsistency)
-        try:
-            # noinspection PyUnresolvedReferences
-            source_size_str = check_output(['identify', img_path_file_name]).decode()
-        except CalledProcessError:  # pragma: nocover
-            return url
-        source_size_str = source_size_str[len(img_path_file_name):].split(' ')[2]
-
-        source_size_array = source_size_str.split(by)
-        source_size_x = int(source_size_array[0])
-        source_size_y = int(source_size_array[1])
-        target_size_x = style_def['size'][0]
-        target_size_y = style_def['size'][1]
-        target_size_str = str(target_size_x) + by + str(target_size_y)
-
-        # thumbnail
-        if style_def['type'] == 'thumbnail':
-            if target_size_x > source_size_x and target_size_y > source_size_y:
-                target_size_str = source_size_str
-            call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-
-        # thumbnail-upscale
-        elif style_def['type'] == 'thumbnail-upscale':
-            call(['convert', img_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-
-        # thumbnail-crop
-        elif style_def['type'] == 'thumbnail-crop':
-            source_ratio = float(source_size_x) / float(source_size_y)
-            target_ratio = float(target_size_x) / float(target_size_y)
-            if source_ratio > target_ratio:  # crop vertically
-                crop_target_size_x = source_size_y * target_ratio
-                crop_target_size_y = source_size_y
-                offset = (source_size_x - crop_target_size_x) / 2
-                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + str(offset) + plus + '0'
-            else:  # crop horizontally
-                crop_target_size_x = source_size_x
-                crop_target_size_y = source_size_x / target_ratio
-                offset = (source_size_y - crop_target_size_y) / 2
-                crop_size_str = str(crop_target_size_x) + by + str(crop_target_size_y) + plus + '0' + plus + str(offset)
-            call(['convert', img_path_file_name, '-crop', crop_size_str, style_path_file_name])
-            call(['convert', style_path_file_name, '-thumbnail', target_size_str, '-antialias', style_path_file_name])
-            # moderators ^ and \> for -thumbnail and -resize do not work consistently:
-            # "invalid argument for option `-resize'"
-            # call(['convert', path_file_name, '-thumbnail', target_size_str + '^', '-gravity', 'center', '-extent',
-            #      target_size_str, '-antialias', style_path_file_name])
-
-        # # crop
-        # elif style_def['type'] == 'crop':
-        #    call(['convert', img_path_file_name, '-gravity', 'center', '-crop', target_size_str, style_path_file_name])
-        #     call(['convert', img_path_file_name, '-gravity', 'center', '-background', 'None', '-extent',
-        #           target_size_str, style_path_file_name])
-    return style_url
+
+def style_signature(style_def):
+    """ Get a signature of an image style definition, to detect changes
+    :param style_def: the style dict with `type` and `size`
+    :return: a signature string
+    """
+    return json.dumps(style_def, sort_keys=True)
+
+
+def manifest_path_file_name():
+    """ Get the path file name of the image styles manifest
+    :return: the absolute path file name under media root
+    """
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_STYLES_MANIFEST)
+
+
+def load_manifest():
+    """ Load the image styles manifest
+    The manifest records each style that derivatives have been generated for, with the signature of its definition
+    and the time since the definition is in effect; derivatives older than that are stale
+    :return: a dictionary of style: {'signature': signature, 'since': timestamp}
+    """
+    try:
+        with open(manifest_path_file_name()) as manifest:
+            return json.load(manifest)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    """ Save the image styles manifest atomically
+    :param manifest: the manifest dictionary
+    :return: None
+    """
+    path_file_name = manifest_path_file_name()
+    os.makedirs(os.path.dirname(path_file_name), exist_ok=True)
+    with open(path_file_name + '.tmp', 'w') as tmp:
+        json.dump(manifest, tmp, indent=2, sort_keys=True)
+    os.replace(path_file_name + '.tmp', path_file_name)
+
+
+def update_manifest(manifest, styles):
+    """ Record the current definition of image styles in the manifest
+    If a style definition has changed, its `since` timestamp is set to now,
+    so that all of its existing derivatives are considered stale
+    Styles not recorded yet are added with `since` 0, so that existing derivatives are kept;
+    as these may have been generated with another definition, they should be checked for size (see `is_stale`)
+    :param manifest: the manifest dictionary, updated in place
+    :param styles: an iterable of image style names
+    :return: a list of the style names that have changed
+    """
+    changed = []
+    for style in styles:
+        signature = style_signature(settings.IMAGE_STYLES[style])
+        if manifest.get(style, {}).get('signature') != signature:
+            if style in manifest:
+                changed.append(style)
+            manifest[style] = {'signature': signature, 'since': time.time() if style in manifest else 0}
+    return changed
+
+
+def is_stale(img_path_file_name, style, since=0, check_size=False):
+    """ Check if an image style derivative is missing or older than the original or the style definition
+    :param img_path_file_name: the absolute path file name of the original image
+    :param style: the image style name
+    :param since: the timestamp since the style definition is in effect
+    :param check_size: also check that the derivative has the size of the current style definition,
+    eg for a style that is not recorded in the manifest yet, whose derivatives may be of an older definition
+    :return: boolean
+    """
+    try:
+        style_mtime = os.path.getmtime(style_path_file_name(img_path_file_name, style))
+    except OSError:
+        return True
+    try:
+        if style_mtime < max(os.path.getmtime(img_path_file_name), since):
+            return True
+    except OSError:  # pragma: nocover
+        return False
+    return check_size and not style_size_matches(img_path_file_name, style)
+
+
+def style_size_matches(img_path_file_name, style):
+    """ Check that an image style derivative has the size of the current style definition, allowing for a pixel
+    of rounding difference among backends; only image headers are read
+    :param img_path_file_name: the absolute path file name of the original image
+    :param style: the image style name
+    :return: boolean; True if the size cannot be determined, eg for unknown style types
+    """
+    try:
+        with PilImage.open(img_path_file_name) as img:
+            result = PillowBackend().target_box(img.size, settings.IMAGE_STYLES[style])
+        with PilImage.open(style_path_file_name(img_path_file_name, style)) as derivative:
+            size = derivative.size
+    except (IOError, OSError):  # pragma: nocover
+        return False
+    if result is None:  # pragma: nocover
+        return True
+    return all(abs(actual - expected) <= 1 for actual, expected in zip(size, result[1]))
+
+
+def generate_styles(img_path_file_name, styles=None):
+    """ Generate the derivatives of an image for all image styles (or the ones specified) that do not exist
+    :param img_path_file_name: the absolute path file name of the original image
+    :param styles: an iterable of image style names, default is all `IMAGE_STYLES`
+    :return: None
+    """
+    for style in styles or settings.IMAGE_STYLES:
+        if not os.path.exists(style_path_file_name(img_path_file_name, style)):
+            generate_style(img_path_file_name, style)
+
+
+def generate_style(img_path_file_name, style):
+    """ Generate an image style derivative using the backend specified in `IMAGE_STYLES_BACKEND`
+    Backends write to a temporary file that is moved in place when complete, as an existing derivative is served as is
+    :param img_path_file_name: the absolute path file name of the original image
+    :param style: the image style name
+    :return: the style path file name; None if the derivative could not be generated
+    """
+    # style path full: ~/ninecms/media/ninecms/basic/image/large/test.png
+    target = style_path_file_name(img_path_file_name, style)
+    if get_backend().generate(img_path_file_name, target, settings.IMAGE_STYLES[style]):
+        return target
+    return None
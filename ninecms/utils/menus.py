@@ -0,0 +1,75 @@
+""" Menu utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from ninecms.utils.cache import TaggedCache
+import copy
+
+trees = TaggedCache('menu', tags=('menu',), timeout=None, local=True)
+
+
+class MenuTree(object):
+    """ A compiled menu tree: all descendants of a menu item with precomputed full paths,
+    along with the ancestor chain of each item and an index of paths for active trail lookups
+    Behaves as a sequence of menu items in tree order, so that it can be used with `recursetree`
+    """
+    def __init__(self, root):
+        """ Compile the menu tree of a menu item in a single query (and one more for the ancestors of the root)
+        :param root: the root menu item
+        :return: None
+        """
+        self.root_id = root.id
+        self.items = list(root.get_descendants())
+        ancestors = list(root.get_ancestors(include_self=True))
+        self.nodes = {}
+        self.trails = {}
+        for item in ancestors + self.items:
+            item._full_path = item.full_path()
+            self.nodes[item.id] = item
+            self.trails[item.id] = self.trails.get(item.parent_id, ()) + (item.id,)
+        # index of path: ids of all items with the path and their ancestors, in tree order
+        self.paths = {}
+        for item in self.items:
+            self.paths.setdefault(item.path, set()).update(self.trails[item.id])
+        for path, node_ids in self.paths.items():
+            self.paths[path] = tuple(sorted(node_ids, key=lambda node_id: (self.nodes[node_id].tree_id,
+                                                                           self.nodes[node_id].lft)))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        """ Iterate over copies of the items, as `recursetree` sets the cached children and parent on each item
+        and the tree is shared among threads
+        :return: an iterator of menu items
+        """
+        return (copy.copy(item) for item in self.items)
+
+    def trail(self, item_id):
+        """ Get a menu item and all of its ancestors
+        :param item_id: the menu item id
+        :return: a list of menu items, from the top level item to the item itself
+        """
+        return [self.nodes[node_id] for node_id in self.trails[item_id]]
+
+    def active_trail(self, path):
+        """ Get the menu items with a path, along with all of their ancestors, with a dictionary lookup
+        :param path: the menu item path, without language (see `get_clean_url`)
+        :return: a list of menu items in tree order
+        """
+        return [self.nodes[node_id] for node_id in self.paths.get(path, ())]
+
+
+def get_menu_tree(root):
+    """ Get the compiled menu tree of a menu item
+    Trees are cached both in process and in the django cache,
+    and invalidated on any change of menu items or menu rebuild (see signals)
+    :param root: the root menu item
+    :return: a MenuTree object
+    """
+    return trees.get_or_set(root.id, lambda: MenuTree(root))
@@ -4,8 +4,20 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
 # noinspection PyPackageRequirements
-from guardian.shortcuts import get_groups_with_perms, assign_perm, remove_perm
+from guardian.shortcuts import get_groups_with_perms, get_objects_for_user
+# noinspection PyPackageRequirements
+from guardian.models import GroupObjectPermission
+from ninecms.models import PageType
+from functools import reduce
+from operator import or_
+from ninecms.utils.cache import TaggedCache, invalidate
+
+snapshots = TaggedCache('perms', tags=('perms',))
 
 
 def get_perms(obj, fields, suffix):
@@ -29,19 +41,61 @@ def get_perms(obj, fields, suffix):
 def set_perms(obj, fields, suffix, perms):
     """ Set group perms on an object
     To be mainly used in form operations, from which the cleaned data of fields are obtained
-    Check if group is in new perms and not in old, and assign, or vice versa
+    The full delta between existing and requested perms is computed and applied in a single transaction,
+    with one bulk insert for the groups to assign and one filtered delete for the groups to remove,
+    instead of a guardian `assign_perm`/`remove_perm` call per group per field
 
-    :param obj: the record object for which to get permissions
+    :param obj: the record object for which to set permissions
     :param fields: the permission names to categorize
     :param suffix: an additional string that, when appended on the field name, will give us the perm name
-    :param perms:
-    :return: a dictionary of fields: groups list
+    :param perms: a dictionary of fields: groups list
+    :return: None
     """
-    old_perms = get_perms(obj, fields, suffix)
-    for field in fields:
-        for group in perms[field]:
-            if group not in old_perms[field]:
-                assign_perm(field + suffix, group, obj)
-        for group in old_perms[field]:
-            if group not in perms[field]:
-                remove_perm(field + suffix, group, obj)
+    content_type = ContentType.objects.get_for_model(obj)
+    object_pk = str(obj.pk)
+    permissions = dict(Permission.objects
+                       .filter(content_type=content_type, codename__in=list(field + suffix for field in fields))
+                       .values_list('codename', 'id'))
+    wanted = set((group.pk, permissions[field + suffix]) for field in fields for group in perms[field])
+    with transaction.atomic():
+        existing = set(GroupObjectPermission.objects
+                       .filter(content_type=content_type, object_pk=object_pk,
+                               permission_id__in=list(permissions.values()))
+                       .values_list('group_id', 'permission_id'))
+        added = wanted - existing
+        if added:
+            GroupObjectPermission.objects.bulk_create(
+                GroupObjectPermission(group_id=group_id, permission_id=permission_id,
+                                      content_type=content_type, object_pk=object_pk)
+                for group_id, permission_id in sorted(added))
+        removed = existing - wanted
+        if removed:
+            GroupObjectPermission.objects\
+                .filter(content_type=content_type, object_pk=object_pk)\
+                .filter(reduce(or_, (Q(group_id=group_id, permission_id=permission_id)
+                                     for group_id, permission_id in removed)))\
+                .delete()
+    invalidate('perms')
+
+
+def get_page_type_perms(request):
+    """ Get a snapshot of the page types on which the current user has node permissions
+    The snapshot is kept on the request and in cache, so that permission checks are set lookups
+    Invalidated when permissions, group memberships or page types change (see signals)
+    :param request: the request object
+    :return: a dictionary of 'add', 'change', 'delete': frozenset of page type ids
+    """
+    user = request.user
+    perms = getattr(request, '_ninecms_page_type_perms', None)
+    if perms is None:
+        tags = ('perms:user:%d' % user.pk,)
+        perms = snapshots.get(user.pk)
+        if perms is None:
+            versions = snapshots.versions(tags)
+            perms = {}
+            for perm in ('add', 'change', 'delete'):
+                page_types = get_objects_for_user(user, 'ninecms.%s_node_pagetype' % perm, klass=PageType)
+                perms[perm] = frozenset(page_types.values_list('id', flat=True))
+            snapshots.set(user.pk, perms, versions)
+        request._ninecms_page_type_perms = perms
+    return perms
@@ -6,13 +6,22 @@ __email__ = 'gkarak@9-dev.com'
 
 from django.conf import settings
 from django.views.generic import View
-from django.db.models import Q
 from django.http import HttpResponse
-from django.template import loader
 from django.utils.text import slugify
-from ninecms.models import Node
-from ninecms.signals import block_signal
+from django.contrib.messages import get_messages
+from ninecms.models import Node, ContentBlock
 from ninecms.forms import ContactForm, LoginForm, SearchForm
+from ninecms.utils.layout import get_page_layout
+from ninecms.utils.menus import get_menu_tree
+from ninecms.utils.search import search_page
+from ninecms.utils.templates import get_page_template
+from ninecms.utils.blocks import LazySignalBlocks, lazy_block, log_blocks, page_tags
+from ninecms.utils.media import placeholders
+from ninecms.utils.cache import TaggedCache
+from functools import partial
+
+aliases = TaggedCache('alias', tags=('alias',))
+pages = TaggedCache('page', tags=('page', 'layout'))
 
 
 # noinspection PyMethodMayBeStatic
@@ -20,25 +29,46 @@ class NodeView(View):
     """ Basic page render functions
     Base class for ContentNodeEditView, AliasView, IndexView
     """
+    def resolve_alias(self, alias, request):
+        """ Resolve a path alias to the node to render for the current language
+        The resolution is cached, including aliases that do not exist (for a shorter time),
+        so that repeated requests for unknown paths such as crawler 404s do not hit the database
+        The order -language returns first objects with language not empty and then with language empty (tested utf8)
+        Requires url alias in db without slashes
+        :param alias: a url path alias
+        :param request: the request object
+        :return: a dictionary with node id, language, status, redirect and link; None if alias does not exist
+        """
+        key = (alias, request.LANGUAGE_CODE)
+        resolution = aliases.get(key)
+        if resolution is None:
+            versions = aliases.versions()
+            resolution = Node.objects\
+                .filter(alias=alias)\
+                .filter(language__in=(request.LANGUAGE_CODE, ''))\
+                .order_by('-language', 'id')\
+                .values('id', 'language', 'status', 'redirect', 'link')\
+                .first() or {}
+            timeout = settings.ALIAS_CACHE_TIMEOUT if resolution else settings.ALIAS_NOT_FOUND_CACHE_TIMEOUT
+            aliases.set(key, resolution, versions, timeout)
+        return resolution or None
+
     def get_node_by_alias(self, alias, request):
         """ Get a node given a path alias
         Query from the opposite direction: https://docs.djangoproject.com/en/1.7/topics/db/examples/many_to_one/
-        The order -language returns first objects with language not empty and then with language empty (tested utf8)
         Prefetch related terms is not necessary if node.terms.all are not called in template (adds 1 query)
         But if terms are populated in template then this reduces the number of queries to 1 from 2
         Also .prefetch_related('terms__nodes')\ can be added if necessary
-        Requires url alias in db without slashes
         :param alias: a url path alias
         :param request: the request object
-        :return: a Node object
+        :return: a Node object; raises IndexError if not exists
         """
+        resolution = self.resolve_alias(alias, request)
+        if resolution is None:
+            raise IndexError
         # .prefetch_related('image_set')\
         # .prefetch_related('terms')\
-        return Node.objects\
-            .filter(alias=alias)\
-            .filter(language__in=(request.LANGUAGE_CODE, ''))\
-            .select_related('page_type')\
-            .order_by('-language', 'id')[0]
+        return Node.objects.filter(id=resolution['id']).select_related('page_type')[0]
 
     def construct_classes(self, type_classes, request):
         """ Construct default body classes for a page
@@ -65,7 +95,7 @@ class NodeView(View):
 
     def construct_context(self, node, request):
         """ Construct the page context
-        Render all blocks in a node page
+        Render all blocks in a node page, as lazy values that are computed when the template uses them
         :param node: the node requested
         :param request: the request object
         :return: context dictionary
@@ -83,62 +113,135 @@ class NodeView(View):
 
         # get all elements (block instances) for this page type and append to page context
         # conveniently structure blocks to be able to access by name instead of looping in template
-        for block in node.page_type.blocks.all():
-            reg = slugify(block.name).replace('-', '_')
-            # static node render
+        # the compiled layout is cached, so that no query is required for blocks, static nodes and menu items
+        # block values are lazy, so that only blocks that the template uses are computed (see `lazy_block`)
+        blocks = get_page_layout(node.page_type_id).blocks
+        signals = LazySignalBlocks(self.__class__, [(reg, block) for reg, block in blocks if block.type == 'signal'],
+                                   node, request)
+        block_types = dict(ContentBlock.BLOCK_TYPES)
+        for reg, block in blocks:
+            # static nodes and menus of other languages or disabled are not rendered
             if block.type == 'static':
-                if block.node.language in (request.LANGUAGE_CODE, '') and block.node.status == 1:
-                    page[reg] = block.node
-            # menu render
+                if block.node.language not in (request.LANGUAGE_CODE, '') or block.node.status != 1:
+                    continue
             elif block.type == 'menu':
-                if block.menu_item.language in (request.LANGUAGE_CODE, '') and block.menu_item.disabled == 0:
-                    page[reg] = block.menu_item.get_descendants()
-            # signal (view) render
-            elif block.type == 'signal':
-                responses = block_signal.send(sender=self.__class__, view=block.signal, node=node, request=request)
-                responses = list(filter(lambda response: response[1] is not None, responses))
-                if responses:
-                    page[reg] = responses[-1][1]
-            # contact form render
-            elif block.type == 'contact':
-                page[reg] = ContactForm(self.session_pop(request, 'contact_form_post', None), initial=request.GET)
-            # language menu render
-            elif block.type == 'language':
-                page[reg] = settings.LANGUAGE_MENU_LABELS
-            # login
-            elif block.type == 'login':
-                page[reg] = LoginForm(self.session_pop(request, 'login_form_post', None))
-            # user menu
-            elif block.type == 'user-menu':
-                page[reg] = True
-            # search form
-            elif block.type == 'search':
-                page[reg] = SearchForm(request.GET)
-            # search results
-            elif block.type == 'search-results':
-                form = SearchForm(request.GET)
-                form.is_valid()
-                results = None
-                if 'q' in form.cleaned_data:
-                    q = form.cleaned_data['q']
-                    results = Node.objects.filter(Q(title__icontains=q) | Q(body__icontains=q) |
-                                                  Q(summary__icontains=q) | Q(highlight__icontains=q))
-                    results = {'q': q, 'nodes': results}
-                page[reg] = results
+                if block.menu_item.language not in (request.LANGUAGE_CODE, '') or block.menu_item.disabled != 0:
+                    continue
+            elif block.type not in block_types:
+                continue
+            # form posts are popped from session anyway, so that they are not rendered in a later page
+            data = None
+            if block.type in ('contact', 'login'):
+                data = self.session_pop(request, '%s_form_post' % block.type, None)
+            page[reg] = lazy_block(request, reg, block.type,
+                                   partial(self.construct_block, reg, block, request, signals, data))
         return page
 
+    def construct_block(self, reg, block, request, signals, data):
+        """ Construct the context value of a block, on first access of the block in the template
+        :param reg: the region key of the block
+        :param block: the block
+        :param request: the request object
+        :param signals: the LazySignalBlocks object of the page
+        :param data: the form post data of contact and login blocks
+        :return: the block value
+        """
+        # static node render
+        if block.type == 'static':
+            return block.node
+        # menu render
+        elif block.type == 'menu':
+            return get_menu_tree(block.menu_item)
+        # signal (view) render
+        elif block.type == 'signal':
+            return signals.get(reg)
+        # contact form render
+        elif block.type == 'contact':
+            return ContactForm(data, initial=request.GET)
+        # language menu render
+        elif block.type == 'language':
+            return settings.LANGUAGE_MENU_LABELS
+        # login
+        elif block.type == 'login':
+            return LoginForm(data)
+        # user menu
+        elif block.type == 'user-menu':
+            return True
+        # search form
+        elif block.type == 'search':
+            return SearchForm(request.GET)
+        # search results
+        elif block.type == 'search-results':
+            form = SearchForm(request.GET)
+            form.is_valid()
+            if 'q' in form.cleaned_data:
+                return search_page(form.cleaned_data['q'], request.LANGUAGE_CODE, request.GET.get('page'))
+        return None
+
+    def page_cache_key(self, request):
+        """ Get the rendered page cache key for a request
+        Pages are cached only for get requests without query string; anonymous users share a single variant,
+        while authenticated users get a variant each, only if `PAGE_CACHE_AUTHENTICATED` is set
+        :param request: the request object
+        :return: a key tuple of path, language and variant; None if the request should not be cached
+        """
+        if not settings.PAGE_CACHE or request.method != 'GET' or request.GET:
+            return None
+        if request.user.is_authenticated():
+            if not settings.PAGE_CACHE_AUTHENTICATED:
+                return None
+            variant = 'user:%d' % request.user.pk
+        else:
+            variant = 'anonymous'
+        return request.path, request.LANGUAGE_CODE, variant
+
+    def page_cache_tags(self, node):
+        """ Get the tags that a rendered page depends on
+        Blocks, static nodes and menu items are covered by the 'layout' tag of the namespace
+        Signal blocks may render anything, so pages with signal blocks also depend on the 'signal' tag, unless all their
+        views declare the models they depend on with a cache policy (see `page_tags` and `block_cache`)
+        :param node: the node rendered
+        :return: a tuple of tags
+        """
+        views = [block.signal for reg, block in get_page_layout(node.page_type_id).blocks if block.type == 'signal']
+        return ('node:%d' % node.id,) + page_tags(views)
+
+    def get_cached_page(self, request):
+        """ Get a rendered page from cache, without any node query or template rendering
+        :param request: the request object
+        :return: a http response; None if page is not cached
+        """
+        key = self.page_cache_key(request)
+        if key is None or len(get_messages(request)):
+            return None
+        page = pages.get(key)
+        if page is None:
+            return None
+        content, content_type = page
+        return HttpResponse(content, content_type=content_type)
+
     def render(self, node, request):
         """
         Render shortcut function
-        Select the proper template based on page type and construct context
+        Select the proper template based on page type (memoized, see `get_page_template`) and construct context
+        Store the rendered page in cache, unless it carries per-request state (messages, form posts, csrf tokens),
+        a signal block has timed out or an image style has not been generated yet (see `image_style`)
         :param node: the node requested
         :param request: the request object
         :return: rendered http response
         """
-        page_type_name = slugify(node.page_type.name).replace('-', '_')
-        t = loader.select_template((
-            'ninecms/page_%s.html' % page_type_name,
-            'ninecms/%s.html' % page_type_name,
-            'ninecms/index.html',
-        ))
-        return HttpResponse(t.render(self.construct_context(node, request), request))
+        key = self.page_cache_key(request)
+        if key is not None:
+            form_posts = ('contact_form_post', 'login_form_post')
+            if len(get_messages(request)) or any(post in request.session for post in form_posts):
+                key = None
+            else:
+                versions = pages.versions(self.page_cache_tags(node))
+        t = get_page_template(node.page_type.name)
+        count = placeholders()
+        response = HttpResponse(t.render(self.construct_context(node, request), request))
+        log_blocks(request, node)
+        if key is not None and not request.META.get('CSRF_COOKIE_USED') \
+                and not getattr(request, 'ninecms_blocks_timed_out', False) and placeholders() == count:
+            pages.set(key, (response.content, response['Content-Type']), versions, settings.PAGE_CACHE_TIMEOUT)
+        return response
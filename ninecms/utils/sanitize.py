@@ -4,42 +4,120 @@ __copyright__ = 'Copyright 2015, George Karakostas'
 __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.encoding import force_text
 from django.utils.html import strip_tags
 from django import forms
+from functools import partial
+import threading
 import bleach
 
 
-def sanitize(t, allow_html=True, full_html=False):
-    """ Bleach clean shortcut function based on pre-defined tags, attributes, styles
+class SanitizePolicy(object):
+    """ A precompiled bleach policy of allowed tags, attributes and styles
+    The sanitizer is built once and reused, instead of on every call of `bleach.clean`
+    Parsers keep state while cleaning, so a separate one is used in each thread
+    """
+    def __init__(self, tags=(), attributes=None, styles=(), strip=False):
+        """ Initialize the policy
+        :param tags: allowed tags
+        :param attributes: allowed attributes per tag
+        :param styles: allowed css properties
+        :param strip: strip disallowed tags instead of escaping them
+        :return: None
+        """
+        self.tags = list(tags)
+        self.attributes = dict(attributes or {})
+        self.styles = list(styles)
+        self.strip = strip
+        self.local = threading.local()
+        if not hasattr(bleach, 'Cleaner') and hasattr(bleach, 'BleachSanitizer'):
+            # bleach < 2: compile the sanitizer class once, as bleach.clean does on every call
+            self.sanitizer = type('PolicySanitizer', (bleach.BleachSanitizer,), {
+                'allowed_elements': self.tags,
+                'allowed_attributes': self.attributes,
+                'allowed_css_properties': self.styles,
+                'strip_disallowed_elements': self.strip,
+                'strip_html_comments': True,
+            })
+
+    def get_cleaner(self):
+        """ Get the cleaner function of the current thread, build it on first use
+        :return: a function that cleans a text
+        """
+        cleaner = getattr(self.local, 'cleaner', None)
+        if cleaner is None:
+            if hasattr(bleach, 'Cleaner'):
+                cleaner = bleach.Cleaner(tags=self.tags, attributes=self.attributes, styles=self.styles,
+                                         strip=self.strip).clean
+            elif hasattr(self, 'sanitizer'):
+                # noinspection PyPackageRequirements
+                import html5lib
+                parser = html5lib.HTMLParser(tokenizer=self.sanitizer)
+
+                def cleaner(text):
+                    """ Parse and sanitize a text with the parser of this thread, render it with bleach """
+                    # noinspection PyProtectedMember
+                    return bleach._render(parser.parseFragment(force_text(text)))
+            else:  # pragma: nocover
+                cleaner = partial(bleach.clean, tags=self.tags, attributes=self.attributes, styles=self.styles,
+                                  strip=self.strip)
+            self.local.cleaner = cleaner
+        return cleaner
+
+    def clean(self, t):
+        """ Clean a text
+        :param t: input text
+        :return: output text
+        """
+        if not t:
+            return t
+        return self.get_cleaner()(t)
+
+
+_policies = {}
+
+
+def get_policy(name):
+    """ Get a sanitize policy from the registry defined in `SANITIZE_POLICIES`
+    Policies are built once and rebuilt only if the setting changes
+    :param name: the policy name, eg 'basic' or 'full'
+    :return: a SanitizePolicy object
+    """
+    if name not in _policies:
+        _policies[name] = SanitizePolicy(**settings.SANITIZE_POLICIES[name])
+    return _policies[name]
+
+
+# noinspection PyUnusedLocal
+@receiver(setting_changed)
+def reset_policies(setting, **kwargs):
+    """ Reset the policy registry when the setting changes, eg in tests
+    :param setting: the setting name
+    :param kwargs: other arguments
+    :return: None
+    """
+    if setting == 'SANITIZE_POLICIES':
+        _policies.clear()
+
+
+def sanitize(t, allow_html=True, full_html=False, policy=None):
+    """ Bleach clean shortcut function based on pre-defined policies of tags, attributes, styles
     NOTE: the allow_html option makes a strip_tag, not bleach, NEVER expose these values with |safe
     This is because bleach and escape turn all <>& to html entities
     :param t: input text
+    :param allow_html: if False strip all tags
+    :param full_html: use the 'full' policy instead of 'basic'
+    :param policy: the name of a policy in `SANITIZE_POLICIES`, overrides full_html
     :return: output text
     """
     if not t:
         return t
     if not allow_html:
         return strip_tags(t)
-    allowed_tags = bleach.ALLOWED_TAGS + ['cite', 'dl', 'dt', 'dd', 'p', 'u', 's', 'sub', 'sup', 'img',
-                                          'table', 'thead', 'tbody', 'tr', 'td', 'th', 'hr', 'iframe',
-                                          'h2', 'h3', 'h4', 'h5', 'h6', 'span', 'br']
-    if full_html:
-        allowed_tags += ['div']
-    allowed_attributes = {
-        'a': ['href', 'title', 'name', 'target', 'class'],
-        'abbr': ['title'],
-        'acronym': ['title'],
-        'p': ['style', 'class'],
-        'img': ['src', 'alt', 'title', 'class'],
-        'iframe': ['src', 'height', 'width', 'class'],
-        'table': ['border', 'cellpadding', 'cellspacing'],
-        'th': ['scope', 'rowspan', 'colspan', 'class'],
-        'td': ['scope', 'rowspan', 'colspan', 'class'],
-        'span': ['style', 'class'],
-        'div': ['style', 'class'],
-    }
-    allowed_styles = ['margin-left', 'text-align', 'width', 'page-break-after', 'display', 'float']
-    return bleach.clean(t, tags=allowed_tags, attributes=allowed_attributes, styles=allowed_styles)
+    return get_policy(policy or ('full' if full_html else 'basic')).clean(t)
 
 
 class ModelSanitizeForm(forms.ModelForm):
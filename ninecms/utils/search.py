@@ -0,0 +1,473 @@
+""" Search utility functions and backends """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.core.paginator import Paginator, InvalidPage
+from django.db import connection, transaction
+from django.db.models import Q, Count, Sum
+from django.utils.html import strip_tags, escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+from django.utils.http import urlencode
+from ninecms.models import Node, SearchToken
+from ninecms.utils.transliterate import transliterate
+from ninecms.utils.cache import TaggedCache
+from collections import Counter
+from html import unescape
+import re
+
+_backends = {}
+
+pages = TaggedCache('search', tags=('search',))
+
+_words = re.compile(r'[^\W_]+')
+
+
+def get_backend():
+    """ Get the search backend specified in `SEARCH_BACKEND`
+    :return: a search backend object
+    """
+    path = settings.SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def tokenize(text):
+    """ Split a text to normalized tokens
+    Html tags and entities are removed, and words are transliterated to lowercase latin characters,
+    so that eg 'Καλημέρα' and 'kalimera' give the same token
+    :param text: the text (or html) to tokenize
+    :return: a list of tokens
+    """
+    tokens = (transliterate(word, False, True)[:100] for word in _words.findall(unescape(strip_tags(text))))
+    return list(token for token in tokens if token)
+
+
+def snippet(text, tokens, length=None):
+    """ Get a plain text snippet of a text around the first word that matches any of the tokens
+    Matching words are highlighted with <mark>
+    :param text: the text (or html) of the node, eg summary or body
+    :param tokens: a set of query tokens (see `tokenize`)
+    :param length: the maximum snippet length in characters; default `SEARCH_SNIPPET_LENGTH`
+    :return: a safe html string
+    """
+    length = length or settings.SEARCH_SNIPPET_LENGTH
+    text = ' '.join(unescape(strip_tags(text)).split())
+    matches = list(m for m in _words.finditer(text) if transliterate(m.group(), False, True) in tokens)
+    start = 0
+    if matches and matches[0].end() > length:
+        start = text.rfind(' ', 0, max(0, matches[0].start() - length // 4)) + 1
+    end = len(text)
+    if end - start > length:
+        end = text.rfind(' ', start, start + length + 1)
+        if end <= start:
+            end = start + length
+    parts = ['&hellip; '] if start else []
+    position = start
+    for match in matches:
+        if match.start() >= start and match.end() <= end:
+            parts.append(escape(text[position:match.start()]))
+            parts.append('<mark>%s</mark>' % escape(match.group()))
+            position = match.end()
+    parts.append(escape(text[position:end]))
+    if end < len(text):
+        parts.append(' &hellip;')
+    return mark_safe(''.join(parts))
+
+
+def search_page(q, language, page_number):
+    """ Get a page of search results with snippets instead of full node bodies
+    Results are capped to `SEARCH_RESULTS_MAX` and paginated by `SEARCH_RESULTS_PER_PAGE`;
+    each page is cached per query and language, and invalidated on any node change
+    :param q: the search query
+    :param language: the current language code
+    :param page_number: the requested page number, eg from the query string; invalid numbers give the first page
+    :return: a dictionary with the query, the result items (title, url, snippet), the total count and the page object
+    """
+    try:
+        page_number = int(page_number)
+    except (TypeError, ValueError):
+        page_number = 1
+    key = (q, language, page_number)
+    entry = pages.get(key)
+    if entry is None:
+        versions = pages.versions()
+        results = get_backend().search(q, language)
+        count = min(results.count(), settings.SEARCH_RESULTS_MAX)
+        paginator = Paginator(range(count), settings.SEARCH_RESULTS_PER_PAGE)
+        try:
+            page = paginator.page(page_number)
+        except InvalidPage:
+            page = paginator.page(paginator.num_pages)
+        tokens = set(tokenize(q))
+        items = list({
+            'title': node.title,
+            'url': node.get_absolute_url(),
+            'snippet': snippet(node.summary or node.body, tokens),
+        } for node in (results[page.start_index() - 1:page.end_index()] if count else ()))
+        entry = (count, page.number, items)
+        pages.set(key, entry, versions, settings.SEARCH_CACHE_TIMEOUT)
+    count, number, items = entry
+    page = Paginator(range(count), settings.SEARCH_RESULTS_PER_PAGE).page(number)
+    return {
+        'q': q,
+        'nodes': items,
+        'count': count,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'query_string': urlencode({'q': q}),
+    }
+
+
+class SearchBackend(object):
+    """ Base class for search backends """
+    def index(self, node):
+        """ Update the index of a node; called on node save
+        :param node: the node object
+        :return: None
+        """
+        pass
+
+    def remove(self, node_id):
+        """ Remove a node from the index; called on node delete
+        :param node_id: the node id
+        :return: None
+        """
+        pass
+
+    def rebuild(self, queryset, progress=None):
+        """ Rebuild the index of nodes
+        :param queryset: the Node queryset to index
+        :param progress: an optional callable that receives the number of nodes indexed
+        :return: the number of nodes indexed
+        """
+        count = 0
+        for node in queryset.only('id', *settings.SEARCH_FIELD_WEIGHTS).iterator():
+            self.index(node)
+            count += 1
+            if progress is not None:
+                progress(count)
+        return count
+
+    def search(self, q, language):  # pragma: nocover
+        """ Search published nodes of a language
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a sliceable sequence of nodes in order of relevance, with a `count()` method
+        """
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    """ Search with a case insensitive containment query on node text fields, without index
+    Scans the whole node table; to be used as a fallback
+    """
+    def rebuild(self, queryset, progress=None):
+        """ There is no index to rebuild
+        :param queryset: the Node queryset to index
+        :param progress: an optional callable that receives the number of nodes indexed
+        :return: 0
+        """
+        return 0
+
+    def search(self, q, language):
+        """ Search published nodes of a language
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a Node queryset, newest first
+        """
+        return Node.objects\
+            .filter(Q(title__icontains=q) | Q(body__icontains=q) |
+                    Q(summary__icontains=q) | Q(highlight__icontains=q))\
+            .filter(status=True, language__in=(language, ''))\
+            .order_by('-created', 'id')
+
+
+class SearchResults(object):
+    """ Ranked search results, evaluated lazily per slice, eg by a paginator
+    Subclasses provide the total count and the node ids of a slice
+    """
+    def __init__(self):
+        """ Initialize results
+        :return: None
+        """
+        self._count = None
+
+    def get_count(self):  # pragma: nocover
+        """ Count the results
+        :return: int
+        """
+        raise NotImplementedError
+
+    def get_node_ids(self, start, stop):  # pragma: nocover
+        """ Get the node ids of a slice of the results
+        :param start: the first result index
+        :param stop: the result index to stop before
+        :return: a list of node ids in order of relevance
+        """
+        raise NotImplementedError
+
+    def count(self):
+        """ Get the total number of results with a single count query
+        :return: int
+        """
+        if self._count is None:
+            self._count = self.get_count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        """ Get the nodes of a slice of the results, in order of relevance
+        :param index: a slice or an integer
+        :return: a list of nodes, or a node if index is an integer
+        """
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        node_ids = self.get_node_ids(start, stop) if stop > start else []
+        nodes = Node.objects.in_bulk(node_ids)
+        return list(nodes[node_id] for node_id in node_ids if node_id in nodes)
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class TokenSearchResults(SearchResults):
+    """ Results of the token search backend """
+    def __init__(self, ranking):
+        """ Initialize results
+        :param ranking: a queryset of node ids and ranks, in order of relevance
+        :return: None
+        """
+        super(TokenSearchResults, self).__init__()
+        self.ranking = ranking
+
+    def get_count(self):
+        """ Count the results
+        :return: int
+        """
+        return self.ranking.count()
+
+    def get_node_ids(self, start, stop):
+        """ Get the node ids of a slice of the results
+        :param start: the first result index
+        :param stop: the result index to stop before
+        :return: a list of node ids in order of relevance
+        """
+        return list(row['node'] for row in self.ranking[start:stop])
+
+
+class RawSearchResults(SearchResults):
+    """ Results of a raw sql search query that selects node ids in order of relevance """
+    def __init__(self, sql, params):
+        """ Initialize results
+        :param sql: the sql query
+        :param params: the query parameters
+        :return: None
+        """
+        super(RawSearchResults, self).__init__()
+        self.sql = sql
+        self.params = list(params)
+
+    def get_count(self):
+        """ Count the results
+        :return: int
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM (%s) results' % self.sql, self.params)
+            return cursor.fetchone()[0]
+
+    def get_node_ids(self, start, stop):
+        """ Get the node ids of a slice of the results
+        :param start: the first result index
+        :param stop: the result index to stop before
+        :return: a list of node ids in order of relevance
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('%s LIMIT %%s OFFSET %%s' % self.sql, self.params + [stop - start, start])
+            return list(row[0] for row in cursor.fetchall())
+
+
+class TokenSearchBackend(SearchBackend):
+    """ Search with an inverted index of node tokens (see `SearchToken`)
+    Each token is weighted by the fields in which it appears (`SEARCH_FIELD_WEIGHTS`) and its occurrences;
+    results contain all tokens of the query and are ranked by the sum of token weights
+    """
+    def tokens(self, node):
+        """ Get the weighted tokens of a node
+        :param node: the node object
+        :return: a Counter of token: weight
+        """
+        tokens = Counter()
+        for field, weight in settings.SEARCH_FIELD_WEIGHTS.items():
+            for token in tokenize(getattr(node, field)):
+                tokens[token] += weight
+        return tokens
+
+    def index(self, node):
+        """ Replace the tokens of a node
+        :param node: the node object
+        :return: None
+        """
+        with transaction.atomic():
+            SearchToken.objects.filter(node_id=node.id).delete()
+            SearchToken.objects.bulk_create(SearchToken(token=token, node_id=node.id, weight=weight)
+                                            for token, weight in self.tokens(node).items())
+
+    def search(self, q, language):
+        """ Search published nodes of a language
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a TokenSearchResults object
+        """
+        tokens = set(tokenize(q))
+        ranking = SearchToken.objects\
+            .filter(token__in=tokens, node__status=True, node__language__in=(language, ''))\
+            .values('node')\
+            .annotate(matches=Count('id'), rank=Sum('weight'))\
+            .filter(matches=len(tokens))\
+            .order_by('-rank', 'node')
+        return TokenSearchResults(ranking if tokens else ranking.none())
+
+
+# Node fields of the full text index, in order of weight label (A, B, C, D in postgresql)
+FULL_TEXT_FIELDS = ('title', 'highlight', 'summary', 'body')
+
+# A query without results, for search queries without tokens
+NO_RESULTS = 'SELECT id FROM ninecms_node WHERE 1 = 0'
+
+
+class FullTextSearchBackend(SearchBackend):
+    """ Base class for full text search backends of the database
+    The index stores the normalized tokens of each field (see `tokenize`), so that matching is transliteration aware
+    """
+    def document(self, node):
+        """ Get the normalized text of each field of a node
+        :param node: the node object
+        :return: a list of strings in the order of `FULL_TEXT_FIELDS`
+        """
+        return list(' '.join(tokenize(getattr(node, field))) for field in FULL_TEXT_FIELDS)
+
+    def weights(self):
+        """ Get the weight of each field
+        :return: a list of numbers in the order of `FULL_TEXT_FIELDS`
+        """
+        return list(settings.SEARCH_FIELD_WEIGHTS.get(field, 0) for field in FULL_TEXT_FIELDS)
+
+
+class SqliteSearchBackend(FullTextSearchBackend):
+    """ Search with an SQLite FTS5 virtual table (see migration 0016), ranked with bm25 """
+    def index(self, node):
+        """ Replace the row of a node in the full text table
+        :param node: the node object
+        :return: None
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM ninecms_node_fts WHERE rowid = %s', [node.id])
+            cursor.execute('INSERT INTO ninecms_node_fts (rowid, title, highlight, summary, body) '
+                           'VALUES (%s, %s, %s, %s, %s)', [node.id] + self.document(node))
+
+    def remove(self, node_id):
+        """ Remove the row of a node from the full text table
+        :param node_id: the node id
+        :return: None
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM ninecms_node_fts WHERE rowid = %s', [node_id])
+
+    def search(self, q, language):
+        """ Search published nodes of a language; all tokens of the query are required
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a RawSearchResults object
+        """
+        tokens = sorted(set(tokenize(q)))
+        if not tokens:
+            return RawSearchResults(NO_RESULTS, [])
+        match = ' '.join('"%s"' % token for token in tokens)
+        sql = "SELECT n.id FROM ninecms_node_fts f INNER JOIN ninecms_node n ON n.id = f.rowid " \
+              "WHERE ninecms_node_fts MATCH %%s AND n.status = %%s AND n.language IN (%%s, '') " \
+              "ORDER BY bm25(ninecms_node_fts, %s), n.id" % ', '.join(str(float(w)) for w in self.weights())
+        return RawSearchResults(sql, [match, True, language])
+
+
+class PostgresSearchBackend(FullTextSearchBackend):
+    """ Search with a tsvector table with a GIN index (see migration 0016), ranked with ts_rank
+    The fields are weighted with the labels A, B, C, D in the order of `FULL_TEXT_FIELDS`
+    """
+    def index(self, node):
+        """ Insert or replace the document of a node
+        :param node: the node object
+        :return: None
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO ninecms_node_search (node_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C') || setweight(to_tsvector('simple', %s), 'D')) "
+                "ON CONFLICT (node_id) DO UPDATE SET document = EXCLUDED.document", [node.id] + self.document(node))
+
+    def search(self, q, language):
+        """ Search published nodes of a language; all tokens of the query are required
+        Documents of deleted nodes are removed by the foreign key
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a RawSearchResults object
+        """
+        tokens = sorted(set(tokenize(q)))
+        if not tokens:
+            return RawSearchResults(NO_RESULTS, [])
+        weights = self.weights()
+        # ts_rank expects the weights of labels in the order D, C, B, A, between 0 and 1
+        weights = list(float(w) / (max(weights) or 1) for w in reversed(weights))
+        sql = "SELECT n.id FROM ninecms_node_search s INNER JOIN ninecms_node n ON n.id = s.node_id " \
+              "WHERE s.document @@ to_tsquery('simple', %s) AND n.status AND n.language IN (%s, '') " \
+              "ORDER BY ts_rank(%s::float4[], s.document, to_tsquery('simple', %s)) DESC, n.id"
+        query = ' & '.join(tokens)
+        return RawSearchResults(sql, [query, language, weights, query])
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """ Search with the full text engine of the database: FTS5 on SQLite, tsvector on PostgreSQL
+    Other databases, or SQLite without FTS5, use the token index (see `TokenSearchBackend`)
+    """
+    def __init__(self):
+        """ Select the backend for the database vendor
+        :return: None
+        """
+        tables = {'sqlite': 'ninecms_node_fts', 'postgresql': 'ninecms_node_search'}
+        backends = {'sqlite': SqliteSearchBackend, 'postgresql': PostgresSearchBackend}
+        table = tables.get(connection.vendor)
+        if table and table in connection.introspection.table_names():
+            self.backend = backends[connection.vendor]()
+        else:  # pragma: nocover
+            self.backend = TokenSearchBackend()
+
+    def index(self, node):
+        """ Update the index of a node
+        :param node: the node object
+        :return: None
+        """
+        self.backend.index(node)
+
+    def remove(self, node_id):
+        """ Remove a node from the index
+        :param node_id: the node id
+        :return: None
+        """
+        self.backend.remove(node_id)
+
+    def search(self, q, language):
+        """ Search published nodes of a language
+        :param q: the search query
+        :param language: the current language code; nodes without language are included
+        :return: a sliceable sequence of nodes in order of relevance, with a `count()` method
+        """
+        return self.backend.search(q, language)
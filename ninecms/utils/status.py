@@ -9,6 +9,10 @@ from django.core.cache import caches, cache
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from ninecms.models import Node, PageType, Image
+from ninecms.utils.imaging import get_backend
+from ninecms.utils.media import forget_image_styles
+from ninecms.utils.cache import clear_local
+from ninecms.utils.templates import reset_page_templates
 from subprocess import call, CalledProcessError
 from io import StringIO
 import sys
@@ -131,10 +135,11 @@ def check_command(command):
 
 
 def imagemagick_status():
-    """ Check that imagemagick utilities are available
-    :return: a list of (imagemagick utility, result)
+    """ Check that the image style backend is available, eg that imagemagick utilities are installed
+    Imagemagick is optional if another backend is selected in `IMAGE_STYLES_BACKEND`
+    :return: True if the backend is not available
     """
-    return not(check_command('identify') and check_command('convert'))
+    return not get_backend().available()
 
 
 def user_stat(user):
@@ -185,7 +190,11 @@ def user_stat(user):
 
 def cache_clear():
     """ Clear cache
+    Also clear the process-local memos: cache tag versions, image style urls and page templates
     If not working try: (memcached only) cache._cache.flush_all()
     :return: None
     """
     cache.clear()
+    clear_local()
+    forget_image_styles()
+    reset_page_templates()
@@ -0,0 +1,66 @@
+""" Background task utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def get_executor():
+    """ Get the background worker pool, create it on first use
+    Created lazily so that it is not inherited by forked server processes
+    :return: a ThreadPoolExecutor object
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.TASKS_WORKERS)
+    return _executor
+
+
+def submit(func, *args, key=None, **kwargs):
+    """ Run a task in the background worker pool
+    If `TASKS_ASYNC` is not set, the task runs immediately in the current thread (eg for tests)
+    Tasks should not access the database, as they are not bound to the request transaction
+    :param func: the callable to run
+    :param args: positional arguments for the callable
+    :param key: an optional hashable key; a task is not submitted if another with the same key is pending
+    :param kwargs: keyword arguments for the callable
+    :return: a Future object; None if the task has run synchronously or is already pending
+    """
+    if not settings.TASKS_ASYNC:
+        func(*args, **kwargs)
+        return None
+    if key is not None:
+        with _lock:
+            if key in _pending:
+                return None
+            _pending.add(key)
+    future = get_executor().submit(func, *args, **kwargs)
+    future.add_done_callback(partial(_task_done, key))
+    return future
+
+
+def _task_done(key, future):
+    """ Release a completed task key and log any exception raised by the task
+    :param key: the task key or None
+    :param future: the completed Future object
+    :return: None
+    """
+    if key is not None:
+        with _lock:
+            _pending.discard(key)
+    error = future.exception()
+    if error is not None:  # pragma: nocover
+        logger.error("Background task failed", exc_info=(type(error), error, error.__traceback__))
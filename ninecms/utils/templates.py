@@ -0,0 +1,86 @@
+""" Page template utility functions """
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+from django.conf import settings
+from django.core.signals import setting_changed, request_started
+from django.db import DatabaseError
+from django.dispatch import receiver
+from django.template import loader
+from django.utils.text import slugify
+import threading
+
+# Resolved and compiled page templates per page type name
+_templates = {}
+_lock = threading.Lock()
+
+
+def page_template_names(page_type_name):
+    """ Get the candidate template names of a page type, in order of priority
+    :param page_type_name: the page type name
+    :return: a tuple of template names
+    """
+    name = slugify(page_type_name).replace('-', '_')
+    return (
+        'ninecms/page_%s.html' % name,
+        'ninecms/%s.html' % name,
+        'ninecms/index.html',
+    )
+
+
+def get_page_template(page_type_name):
+    """ Get the template of a page type
+    Templates are selected and compiled once per process, so that no template directories are probed per request
+    In debug mode templates are selected on each call, so that changes of template files apply immediately
+    :param page_type_name: the page type name
+    :return: a template object
+    """
+    if settings.DEBUG:
+        return loader.select_template(page_template_names(page_type_name))
+    template = _templates.get(page_type_name)
+    if template is None:
+        template = loader.select_template(page_template_names(page_type_name))
+        with _lock:
+            _templates[page_type_name] = template
+    return template
+
+
+def warm_page_templates():
+    """ Select and compile the templates of all page types, eg on the first request (see `PAGE_TEMPLATES_WARM`)
+    :return: the number of page types warmed; None if page types cannot be queried, eg before migrations
+    """
+    from ninecms.models import PageType
+    try:
+        names = list(PageType.objects.values_list('name', flat=True))
+    except DatabaseError:  # pragma: nocover
+        return None
+    for name in names:
+        get_page_template(name)
+    return len(names)
+
+
+# noinspection PyUnusedLocal
+def warm_on_first_request(**kwargs):
+    """ Warm the page templates on the first request of the process, as a receiver of `request_started`
+    Connected on app ready if `PAGE_TEMPLATES_WARM` is set; page types are not queried at startup,
+    as the database may not be ready then, eg on `migrate`
+    :param kwargs: the signal arguments
+    :return: None
+    """
+    request_started.disconnect(dispatch_uid='ninecms_warm_page_templates')
+    warm_page_templates()
+
+
+# noinspection PyUnusedLocal
+@receiver(setting_changed)
+def reset_page_templates(setting=None, **kwargs):
+    """ Reset the selected templates when the template engines are reset, eg in tests, or on cache clear
+    :param setting: the setting name, if called on setting change
+    :param kwargs: other arguments
+    :return: None
+    """
+    if setting in (None, 'TEMPLATES', 'DEBUG', 'INSTALLED_APPS'):
+        with _lock:
+            _templates.clear()
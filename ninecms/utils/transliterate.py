@@ -5,81 +5,139 @@ __licence__ = 'BSD-3'
 __email__ = 'gkarak@9-dev.com'
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Single character mappings per language
+# Currently supporting Greek, Serbian, Russian, Bulgarian
+# Priority by order: the first language that maps a character wins
+MAPPING = (
+    ('el', (
+        'αβγδεζηικλμνξοπρστυφωΑΒΓΔΕΖΗΙΚΛΜΝΞΟΠΡΣΤΥΦΩάέίήύόώϊϋΐΰςΆΈΊΉΎΌΏ',
+        'abgdeziiklmnxoprstyfoABGDEZIIKLMNXOPRSTYFOaeiiyooiyiysAEIIYOO',
+    )),
+    ('rs', (
+        'абвгдезијклмнопрстуфхцАБВГДЕЗИЈКЛМНОПРСТУФХЦ',
+        'abvgdezijklmnoprstufhcABVGDEZIJKLMNOPRSTUFHC',
+    )),
+    ('ru', (
+        'абвгдезийклмнопрстуфхъыьАБВГДЕЗИЙКЛМНОПРСТУФХЪЫЬ',
+        'abvgdezijklmnoprstufh_y_ABVGDEZIJKLMNOPRSTUFH_Y_',
+    )),
+    ('bg', (
+        'абвгдезийклмнопрстуфхАБВГДЕЗИЙКЛМНОПРСТУФХ',
+        'abvgdeziyklmnoprstufhABVGDEZIYKLMNOPRSTUFH',
+    )),
+)
+
+# Multiple character mappings per language
+# Single character mappings above have priority
+EXT_MAPPING = (
+    ('el', (
+        ('θ',  'χ',  'ψ',  'Θ',  'Χ',  'Ψ'),
+        ('th', 'ch', 'ps', 'Th', 'Ch', 'Ps')
+    )),
+    ('rs', (
+        ('ђ',  'ж',  'љ',  'њ',  'ћ', 'ч',  'џ',  'ш',  'Ђ',  'Ж',  'Љ',  'Њ',  'Ћ', 'Ч',  'Џ',  'Ш'),
+        ('dj', 'zh', 'lj', 'nj', 'c', 'ch', 'dz', 'sh', 'Dj', 'Zh', 'Lj', 'Nj', 'C', 'Ch', 'Dz', 'Sh'),
+    )),
+    ('rs_latin', (
+        ('đ',  'ž',  'ć', 'č',  'š',  'Đ',  'Ž',  'Ć', 'Č',  'Š'),
+        ('dj', 'zh', 'c', 'ch', 'sh', 'Dj', 'Zh', 'C', 'Ch', 'Sh'),
+    )),
+    ('ru', (
+        ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+        ('zh', 'ts', 'ch', 'sh', 'sch', 'ju', 'ja', 'Zh', 'Ts', 'Ch', 'Sh', 'Sch', 'Ju', 'Ja'),
+    )),
+    ('bg', (
+        ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+        ('zh', 'ts', 'ch', 'sh', 'sht', 'yu', 'ya', 'Zh', 'Ts', 'Ch', 'Sh', 'Sht', 'Yu', 'Ya'),
+    )),
+)
+
+# Compiled translation tables, per filename rule
+_tables = {}
+
+
+def compile_table(filename):
+    """ Compile a single translation table that performs all steps of transliteration in one pass:
+    character mappings of all languages, punctuation replacement and removal
+    Mappings of `TRANSLITERATE_LANGUAGES` have priority over the built-in ones
+    :param filename: if true, the rule for file names is followed
+    :return: a translation table for `str.translate`
+    """
+    # transliteration: first mapping wins
+    letters = {}
+    for lang, mapping in sorted(settings.TRANSLITERATE_LANGUAGES.items()):
+        for char, value in mapping.items():
+            letters.setdefault(ord(char), value)
+    for lang, (chars, values) in MAPPING:
+        for char, value in zip(chars, values):
+            letters.setdefault(ord(char), value)
+    for lang, (chars, values) in EXT_MAPPING:
+        for char, value in zip(chars, values):
+            letters.setdefault(ord(char), value)
+
+    # punctuation: applied on the result of transliteration
+    # "'`,.-_:;|{[}]+=*&%^$#@!~()?<>/\
+    remove = settings.TRANSLITERATE_REMOVE
+    if filename:
+        remove += '/\?%*:|"<>'
+        punctuation = {ord(' '): '_'}
+    else:
+        punctuation = str.maketrans(settings.TRANSLITERATE_REPLACE[0], settings.TRANSLITERATE_REPLACE[1])
+    punctuation.update({ord(i): None for i in remove})
+
+    # compose: every character that any step changes maps to its final value
+    table = {}
+    for key in set(letters) | set(punctuation):
+        table[key] = chr(key).translate(letters).translate(punctuation)
+    return table
+
+
+def get_table(filename):
+    """ Get the compiled translation table, compile on first use
+    :param filename: if true, the rule for file names is followed
+    :return: a translation table for `str.translate`
+    """
+    table = _tables.get(filename)
+    if table is None:
+        table = _tables[filename] = compile_table(filename)
+    return table
+
+
+# noinspection PyUnusedLocal
+@receiver(setting_changed)
+def reset_tables(setting, **kwargs):
+    """ Reset the compiled tables when a transliteration setting changes, eg in tests
+    :param setting: the setting name
+    :param kwargs: other arguments
+    :return: None
+    """
+    if setting.startswith('TRANSLITERATE_'):
+        _tables.clear()
 
 
 def transliterate(s, filename=False, to_lower=False):
     """ Transliterate unicode characters
-    Currently supporting Greek, Serbian, Russian, Bulgarian
-    Priority by order
+    Uses a single translation table compiled once per settings (see `compile_table`)
     :param s: the string to transliterate
     :param filename: if true, different rule for punctuation is followed
     :param to_lower: convert to lowercase
     :return: the transliterated string
     """
-    mapping = {
-        'el': (
-            'αβγδεζηικλμνξοπρστυφωΑΒΓΔΕΖΗΙΚΛΜΝΞΟΠΡΣΤΥΦΩάέίήύόώϊϋΐΰςΆΈΊΉΎΌΏ',
-            'abgdeziiklmnxoprstyfoABGDEZIIKLMNXOPRSTYFOaeiiyooiyiysAEIIYOO',
-        ),
-        'rs': (
-            'абвгдезијклмнопрстуфхцАБВГДЕЗИЈКЛМНОПРСТУФХЦ',
-            'abvgdezijklmnoprstufhcABVGDEZIJKLMNOPRSTUFHC',
-        ),
-        'ru': (
-            'абвгдезийклмнопрстуфхъыьАБВГДЕЗИЙКЛМНОПРСТУФХЪЫЬ',
-            'abvgdezijklmnoprstufh_y_ABVGDEZIJKLMNOPRSTUFH_Y_',
-        ),
-        'bg': (
-            'абвгдезийклмнопрстуфхАБВГДЕЗИЙКЛМНОПРСТУФХ',
-            'abvgdeziyklmnoprstufhABVGDEZIYKLMNOPRSTUFH',
-        ),
-    }
-    ext_mapping = {
-        'el': (
-            ('θ',  'χ',  'ψ',  'Θ',  'Χ',  'Ψ'),
-            ('th', 'ch', 'ps', 'Th', 'Ch', 'Ps')
-        ),
-        'rs': (
-            ('ђ',  'ж',  'љ',  'њ',  'ћ', 'ч',  'џ',  'ш',  'Ђ',  'Ж',  'Љ',  'Њ',  'Ћ', 'Ч',  'Џ',  'Ш'),
-            ('dj', 'zh', 'lj', 'nj', 'c', 'ch', 'dz', 'sh', 'Dj', 'Zh', 'Lj', 'Nj', 'C', 'Ch', 'Dz', 'Sh'),
-        ),
-        'rs_latin': (
-            ('đ',  'ž',  'ć', 'č',  'š',  'Đ',  'Ž',  'Ć', 'Č',  'Š'),
-            ('dj', 'zh', 'c', 'ch', 'sh', 'Dj', 'Zh', 'C', 'Ch', 'Sh'),
-        ),
-        'ru': (
-            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
-            ('zh', 'ts', 'ch', 'sh', 'sch', 'ju', 'ja', 'Zh', 'Ts', 'Ch', 'Sh', 'Sch', 'Ju', 'Ja'),
-        ),
-        'bg': (
-            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
-            ('zh', 'ts', 'ch', 'sh', 'sht', 'yu', 'ya', 'Zh', 'Ts', 'Ch', 'Sh', 'Sht', 'Yu', 'Ya'),
-        ),
-    }
-    for lang in mapping:
-        s = s.translate(str.maketrans(mapping[lang][0], mapping[lang][1]))
-    for lang in ext_mapping:
-        for i, val in enumerate(ext_mapping[lang][0]):
-            s = s.replace(ext_mapping[lang][0][i], ext_mapping[lang][1][i])
-    # "'`,.-_:;|{[}]+=*&%^$#@!~()?<>/\
-    remove = settings.TRANSLITERATE_REMOVE
-    if filename:
-        remove += '/\?%*:|"<>'
-        s = s.replace(' ', '_')
-    else:
-        s = s.translate(str.maketrans(settings.TRANSLITERATE_REPLACE[0], settings.TRANSLITERATE_REPLACE[1]))
-    s = s.translate({ord(i): None for i in remove})
+    s = s.translate(get_table(filename))
     if to_lower:
         s = s.lower()
     return s
 
 
+_upper_table = str.maketrans('ΆΈΊΉΎΌΏ', 'ΑΕΙΗΥΟΩ')
+
+
 def upper_no_intonation(s):
     """ Convert a string to uppercase, removing any intonation
     :param s: the string to convert
     :return: the converted string
     """
-    mapping = ('ΆΈΊΉΎΌΏ', 'ΑΕΙΗΥΟΩ')
-    s = s.upper()
-    s = s.translate(str.maketrans(mapping[0], mapping[1]))
-    return s
+    return s.upper().translate(_upper_table)
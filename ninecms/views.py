@@ -16,7 +16,9 @@ from django.contrib.auth.models import Group
 from django.utils.translation import ugettext as _
 from ninecms.utils.render import NodeView
 from ninecms.utils.perms import get_perms, set_perms
+from ninecms.utils.nodes import get_full_path
 from ninecms.utils import status
+from ninecms.utils.cache import invalidate
 from ninecms.models import Node, PageType, MenuItem
 from ninecms.forms import ContactForm, LoginForm, RedirectForm, ContentTypePermissionsForm
 
@@ -31,6 +33,9 @@ class ContentNodeView(NodeView):
         :param kwargs: contains node_id
         :return: response object
         """
+        response = self.get_cached_page(request)
+        if response is not None:
+            return response
         node = get_object_or_404(Node, id=kwargs['node_id'])
         if node.alias:
             return redirect('ninecms:alias', url_alias=(node.alias + '/'), permanent=True)
@@ -51,14 +56,21 @@ class AliasView(NodeView):
             alias = kwargs['url_alias'][:-1]
             if alias == '/':
                 return redirect('ninecms:index', permanent=True)  # pragma: no cover
+            response = self.get_cached_page(request)
+            if response is not None:
+                return response
+            # check the cached resolution first, so that 404, 403 and redirects do not hit the database
+            resolution = self.resolve_alias(alias, request)
+            if resolution is None:
+                raise Http404
+            if not resolution['status'] and not request.user.has_perm('ninecms.view_unpublished'):
+                raise PermissionDenied
+            if resolution['redirect']:
+                return redirect(get_full_path(resolution['link'], resolution['language']), permanent=True)
             try:
                 node = self.get_node_by_alias(alias, request)
-            except IndexError:
+            except IndexError:  # pragma: nocover
                 raise Http404
-            if not node.status and not request.user.has_perm('ninecms.view_unpublished'):
-                raise PermissionDenied
-            if node.redirect:
-                return redirect(node.get_redirect_path(), permanent=True)
             return self.render(node, request)
         else:
             return redirect('ninecms:alias', url_alias=(kwargs['url_alias'] + '/'), permanent=True)
@@ -71,6 +83,9 @@ class IndexView(NodeView):
         :param request: the request object
         :return: response object
         """
+        response = self.get_cached_page(request)
+        if response is not None:
+            return response
         try:
             node = self.get_node_by_alias('/', request)
         except IndexError:
@@ -219,6 +234,7 @@ class StatusView(View):
         if 'menu-rebuild' in request.POST:
             # noinspection PyUnresolvedReferences
             MenuItem.objects.rebuild()
+            invalidate('menu', 'layout')
             messages.success(request, _("Menu has been rebuilt."))
         if 'clear-cache' in request.POST:
             status.cache_clear()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of transliteration: compiled tables against the previous implementation
+Usage: python tests/benchmark_transliterate.py [number]
+"""
+__author__ = 'George Karakostas'
+__copyright__ = 'Copyright 2015, George Karakostas'
+__licence__ = 'BSD-3'
+__email__ = 'gkarak@9-dev.com'
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings_test")
+
+import django
+django.setup()
+
+from django.conf import settings
+from ninecms.utils.transliterate import transliterate
+
+SAMPLES = (
+    "Ξεσκεπάζω την ψυχοφθόρα βδελυγμία",
+    "Τάχιστη αλώπηξ βαφής ψημένη γη, δρασκελίζει υπέρ νωθρού κυνός",
+    "Љубазни фењерџија чађавог лица хоће да ми покаже штос.",
+    "Съешь же ещё этих мягких французских булок, да выпей чаю",
+    "Жълтата дюля беше щастлива, че пухът, който цъфна, замръзна като гьон.",
+    "Đače, uštedu plaćaj žaljenjem zbog džinovskih cifara.",
+    "The quick brown fox jumps over the lazy dog (v0.6.1) & friends!",
+)
+
+
+def legacy_transliterate(s, filename=False, to_lower=False):
+    """ Transliterate unicode characters, as implemented before compiled tables (v0.6.0)
+    Currently supporting Greek, Serbian, Russian, Bulgarian
+    Priority by order
+    :param s: the string to transliterate
+    :param filename: if true, different rule for punctuation is followed
+    :param to_lower: convert to lowercase
+    :return: the transliterated string
+    """
+    mapping = {
+        'el': (
+            'αβγδεζηικλμνξοπρστυφωΑΒΓΔΕΖΗΙΚΛΜΝΞΟΠΡΣΤΥΦΩάέίήύόώϊϋΐΰςΆΈΊΉΎΌΏ',
+            'abgdeziiklmnxoprstyfoABGDEZIIKLMNXOPRSTYFOaeiiyooiyiysAEIIYOO',
+        ),
+        'rs': (
+            'абвгдезијклмнопрстуфхцАБВГДЕЗИЈКЛМНОПРСТУФХЦ',
+            'abvgdezijklmnoprstufhcABVGDEZIJKLMNOPRSTUFHC',
+        ),
+        'ru': (
+            'абвгдезийклмнопрстуфхъыьАБВГДЕЗИЙКЛМНОПРСТУФХЪЫЬ',
+            'abvgdezijklmnoprstufh_y_ABVGDEZIJKLMNOPRSTUFH_Y_',
+        ),
+        'bg': (
+            'абвгдезийклмнопрстуфхАБВГДЕЗИЙКЛМНОПРСТУФХ',
+            'abvgdeziyklmnoprstufhABVGDEZIYKLMNOPRSTUFH',
+        ),
+    }
+    ext_mapping = {
+        'el': (
+            ('θ',  'χ',  'ψ',  'Θ',  'Χ',  'Ψ'),
+            ('th', 'ch', 'ps', 'Th', 'Ch', 'Ps')
+        ),
+        'rs': (
+            ('ђ',  'ж',  'љ',  'њ',  'ћ', 'ч',  'џ',  'ш',  'Ђ',  'Ж',  'Љ',  'Њ',  'Ћ', 'Ч',  'Џ',  'Ш'),
+            ('dj', 'zh', 'lj', 'nj', 'c', 'ch', 'dz', 'sh', 'Dj', 'Zh', 'Lj', 'Nj', 'C', 'Ch', 'Dz', 'Sh'),
+        ),
+        'rs_latin': (
+            ('đ',  'ž',  'ć', 'č',  'š',  'Đ',  'Ž',  'Ć', 'Č',  'Š'),
+            ('dj', 'zh', 'c', 'ch', 'sh', 'Dj', 'Zh', 'C', 'Ch', 'Sh'),
+        ),
+        'ru': (
+            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+            ('zh', 'ts', 'ch', 'sh', 'sch', 'ju', 'ja', 'Zh', 'Ts', 'Ch', 'Sh', 'Sch', 'Ju', 'Ja'),
+        ),
+        'bg': (
+            ('ж',  'ц',  'ч',  'ш',  'щ',   'ю',  'я',  'Ж',  'Ц',  'Ч',  'Ш',  'Щ',   'Ю',  'Я'),
+            ('zh', 'ts', 'ch', 'sh', 'sht', 'yu', 'ya', 'Zh', 'Ts', 'Ch', 'Sh', 'Sht', 'Yu', 'Ya'),
+        ),
+    }
+    for lang in mapping:
+        s = s.translate(str.maketrans(mapping[lang][0], mapping[lang][1]))
+    for lang in ext_mapping:
+        for i, val in enumerate(ext_mapping[lang][0]):
+            s = s.replace(ext_mapping[lang][0][i], ext_mapping[lang][1][i])
+    # "'`,.-_:;|{[}]+=*&%^$#@!~()?<>/\
+    remove = settings.TRANSLITERATE_REMOVE
+    if filename:
+        remove += '/\?%*:|"<>'
+        s = s.replace(' ', '_')
+    else:
+        s = s.translate(str.maketrans(settings.TRANSLITERATE_REPLACE[0], settings.TRANSLITERATE_REPLACE[1]))
+    s = s.translate({ord(i): None for i in remove})
+    if to_lower:
+        s = s.lower()
+    return s
+
+
+def main(number=10000):
+    """ Check that results are identical, then time both implementations
+    :param number: the number of repetitions over all samples
+    :return: None
+    """
+    for sample in SAMPLES:
+        for args in ((False, False), (True, True), (False, True)):
+            assert transliterate(sample, *args) == legacy_transliterate(sample, *args), (sample, args)
+    for name, func in (('legacy', legacy_transliterate), ('compiled', transliterate)):
+        for args in ((False, True), (True, True)):
+            seconds = timeit.timeit(lambda: [func(sample, *args) for sample in SAMPLES], number=number)
+            print("%-8s filename=%-5s %8.1f us/call" % (name, args[0], seconds * 1e6 / number / len(SAMPLES)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -200,3 +200,5 @@ IMAGE_STYLES.update({
         'size': (150, 150)
     },
 })
+
+TASKS_ASYNC = False